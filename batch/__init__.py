@@ -1,8 +1,15 @@
 from otree.api import *
-import random
 import json
-import io
-import csv
+import math
+
+from sqlalchemy import bindparam
+
+from common.case_index import DescriptionCache
+from common.clearing import NO_WINNER, clear_case_bids, clearing_rng, clearing_seed
+from common.ingest import ingest_cases
+from common.judges import register_judge
+from common.metrics import instrument_live, timed, summary as metrics_summary
+from common.upload import discard_upload, get_upload, handle_upload
 
 doc = """
 In this game, players bid on cases. The player with the lowest bid wins the case.
@@ -28,27 +35,20 @@ class Player(BasePlayer):
     username = models.StringField(blank=True)
     password = models.StringField(blank=True)
 
-    # Store the entire CSV text that the admin pastes in.
-    csv_data = models.LongStringField(blank=True)
+    # The uploaded CSV's SHA-256 and how many cases it had (the file
+    # itself is only kept until it's imported).
+    csv_sha256 = models.StringField(blank=True)
+    csv_rows = models.IntegerField(blank=True)
 
     # For Judges
     assigned_case_ids = models.StringField(blank=True, doc="Stores assigned case IDs as a JSON string")
     player_payoff = models.CurrencyField(initial=0, doc="Player's total payoff")
+    # What the Bid page submits: {case_id: amount} for just the cases bid
+    # on. Only carries the form to before_next_page, which moves the bids
+    # into CaseBid (one row per case) and empties it.
+    bids = models.LongStringField(blank=True, doc="Submitted bids as a JSON object of case ID to amount; emptied once stored in CaseBid")
 
 
-# Add bid fields dynamically
-for i in range(1, 100):  # up to 100 possible cases
-    setattr(
-        Player,
-        f"bid_case_{i}",
-        models.CurrencyField(
-            blank=True,
-            min=C.BID_MIN,
-            max=C.BID_MAX,
-            label=f"Bid for Case {i}",
-        ),
-    )
-
 class Judge(ExtraModel):
     subsession = models.Link(Subsession)
     player = models.Link(Player)
@@ -64,6 +64,16 @@ class Case(ExtraModel):
     points = models.IntegerField()
     date_filled = models.StringField()
     description = models.LongStringField()
+    # hash of the CSV row, so a re-upload only rewrites cases that changed;
+    # cases dropped from a re-upload are retired rather than deleted
+    content_hash = models.StringField()
+    retired = models.BooleanField(default=False)
+    # derived at ingest (see common.ingest), so sorting and filtering
+    # compare integers instead of re-parsing strings
+    date_ordinal = models.IntegerField()
+    priority_rank = models.IntegerField()
+    region_code = models.IntegerField()
+    case_type_code = models.IntegerField()
     # assignment logic
     is_assigned = models.BooleanField(default=False)
     assigned_judge = models.Link(Judge)
@@ -81,44 +91,144 @@ def creating_session(subsession: Subsession):
     """
     Initalization of game settings.
     """
+    # fixes how this session's ties are broken (see common.clearing)
+    clearing_seed(subsession.session)
     for player in subsession.get_players():
         if player.participant.vars.get('role') == 'judge':
             # Create a Judge object for this player
-            Judge.create(
-                subsession=subsession,
-                player=player,
-                judge_id=player.id_in_group  
-            )
+            register_judge(player, Judge)
 
 
+@timed
 def set_assignments(group: Group):
     """
     Logic for how to define which Judge successfully wins which bid.
     Determined by whoever bid the lowest amount for a given case.
+
+    All bids are read in one query and cleared together by common.clearing,
+    with ties broken by the session's seeded random stream, so the result
+    can be replayed from the stored bids (python -m common.replay).
+    Assignments are written with one executemany UPDATE, and each winning
+    player is updated once.
     """
     subsession = group.subsession
-    cases = Case.filter(subsession=subsession)
-
-    for case in cases:
-        case_bids = CaseBid.filter(subsession=subsession, case=case)
-        case_bids = [bid for bid in case_bids if bid.bid_amount is not None]
-        if case_bids:
-            min_bid_amount = min(bid.bid_amount for bid in case_bids)
-            lowest_bidders = [bid for bid in case_bids if bid.bid_amount == min_bid_amount]
-            winner_bid = random.choice(lowest_bidders)
-            winner_player = winner_bid.player
-            case.is_assigned = True
-
-            # assign case to the winning judge
-            judge_qs = Judge.filter(subsession=subsession, player=winner_player)
-            if judge_qs:
-                case.assigned_judge = judge_qs[0]
-
-            assigned_case_ids_str = winner_player.field_maybe_none('assigned_case_ids') or "[]"
-            assigned_cases = json.loads(assigned_case_ids_str)
-            assigned_cases.append(case.case_id)
-            winner_player.assigned_case_ids = json.dumps(assigned_cases)
-            winner_player.player_payoff += winner_bid.bid_amount
+    # case primary key -> case_id, for the cases still on offer
+    case_ids = dict(
+        Case.objects_filter(subsession=subsession, retired=False).with_entities(Case.id, Case.case_id)
+    )
+    # player id -> Judge primary key
+    judge_pks = dict(Judge.objects_filter(subsession=subsession).with_entities(Judge.player_id, Judge.id))
+
+    # in the order they were made, so the session's seed always breaks
+    # ties the same way (common.replay depends on this)
+    bids = (
+        CaseBid.objects_filter(CaseBid.bid_amount.isnot(None), subsession=subsession)
+        .order_by(CaseBid.id)
+        .with_entities(CaseBid.case_id, CaseBid.player_id, CaseBid.bid_amount)
+        .all()
+    )
+    rng = clearing_rng(clearing_seed(subsession.session), subsession.round_number)
+    case_pks, winners, prices, _ = clear_case_bids(bids, case_ids, rng)
+
+    # player id -> case_ids won, and the sum of the winning bids
+    won = {}
+    payoffs = {}
+    assignments = []
+    for i in (winners != NO_WINNER).nonzero()[0]:
+        case_pk = int(case_pks[i])
+        winner = int(winners[i])
+        won.setdefault(winner, []).append(case_ids[case_pk])
+        payoffs[winner] = payoffs.get(winner, 0) + cu(prices[i])
+        assignments.append({
+            '_id': case_pk,
+            'is_assigned': True,
+            'assigned_judge_id': judge_pks.get(winner),
+        })
+
+    if assignments:
+        table = Case.__table__
+        # no Case rows are loaded here, so nothing in the session goes stale
+        Case.objects_filter().session.execute(
+            table.update().where(table.c.id == bindparam('_id')), assignments
+        )
+
+    for player in group.get_players():
+        if player.id in won:
+            assigned_cases = json.loads(player.field_maybe_none('assigned_case_ids') or "[]")
+            player.assigned_case_ids = json.dumps(assigned_cases + won[player.id])
+            player.player_payoff += payoffs[player.id]
+
+
+def load_descriptions(subsession: Subsession, case_ids):
+    rows = Case.objects_filter(Case.case_id.in_(case_ids), subsession=subsession)
+    return dict(rows.with_entities(Case.case_id, Case.description))
+
+
+descriptions = DescriptionCache(load_descriptions)
+
+
+def parse_bids(text, case_ids):
+    """
+    Reads what the Bid page submits, a JSON object of {case_id: amount}
+    for the cases the judge bid on; case_ids are the cases open for
+    bidding. Returns {case_id: amount}, or raises ValueError describing
+    the first problem found.
+    """
+    try:
+        submitted = json.loads(text or '{}')
+    except ValueError:
+        raise ValueError('Your bids could not be read. Please try again.') from None
+    if not isinstance(submitted, dict):
+        raise ValueError('Your bids could not be read. Please try again.')
+
+    bids = {}
+    for key, amount in submitted.items():
+        try:
+            case_id = int(key)
+        except ValueError:
+            raise ValueError(f'"{key}" is not a case ID.') from None
+        if case_id not in case_ids:
+            raise ValueError(f'Case {case_id} is not open for bidding.')
+        if isinstance(amount, bool) or not isinstance(amount, (int, float)) or not math.isfinite(amount):
+            raise ValueError(f'Your bid for case {case_id} is not a number.')
+        amount = cu(amount)
+        if not C.BID_MIN <= amount <= C.BID_MAX:
+            raise ValueError(f'Your bid for case {case_id} must be between {C.BID_MIN} and {C.BID_MAX}.')
+        bids[case_id] = amount
+    return bids
+
+
+def int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+@instrument_live
+def bid_live_method(player, data):
+    """
+    The Bid page only gets case summaries; descriptions are fetched here
+    in batches for the cards the judge is looking at. Ids that aren't
+    integers are skipped.
+    """
+    if data.get('action') == 'describe':
+        case_ids = data.get('case_ids')
+        if not isinstance(case_ids, list):
+            case_ids = []
+        case_ids = [cid for cid in map(int_or_none, case_ids) if cid is not None]
+        return {
+            player.id_in_group: {
+                'action': 'describe',
+                'descriptions': descriptions.describe(player.subsession, case_ids)
+            }
+        }
+
+
+@instrument_live
+def admin_live_method(player, data):
+    """Receives the cases CSV in chunks (see common.upload)"""
+    return handle_upload(player, data)
 
 
 class Login(Page):
@@ -130,6 +240,7 @@ class Login(Page):
     form_fields = ['username', 'password']
 
     @staticmethod
+    @timed
     def vars_for_template(player: Player):
         return {}
 
@@ -139,6 +250,7 @@ class Login(Page):
             return "Please enter both username and password."
 
     @staticmethod
+    @timed
     def before_next_page(player: Player, timeout_happened):
         username = player.username
         password = player.password
@@ -148,6 +260,7 @@ class Login(Page):
             player.participant.vars['role'] = "admin"
         elif username.startswith("judge") and password == "judge":
             player.participant.vars['role'] = "judge"
+            register_judge(player, Judge)
         else:
             print("Incorrect username and password combination. Please try again.")
             return ValueError
@@ -160,32 +273,33 @@ class Admin(Page):
     Judges to select/bid for. 
     """
     form_model = 'player'
-    form_fields = ['csv_data']
+    form_fields = ['csv_sha256']
+    live_method = admin_live_method
 
     @staticmethod
+    def error_message(player: Player, values):
+        digest = values['csv_sha256']
+        if not digest:
+            return
+        upload = get_upload(player)
+        if upload is None or not upload.is_valid(digest):
+            return "The file didn't finish uploading or has problems; please choose it again."
+
+    @staticmethod
+    @timed
     def before_next_page(player: Player, timeout_happened):
-        data_str = player.csv_data or ""
-        if not data_str.strip():
+        upload = get_upload(player)
+        if not player.csv_sha256 or upload is None:
+            discard_upload(player)
             return  # No data uploaded
 
-        f = io.StringIO(data_str)
-        reader = csv.DictReader(f, delimiter=',') 
-
-        num_cases = 0
-        for row in reader:
-            num_cases += 1
-            Case.create(
-                subsession=player.subsession,
-                case_id=int(row['Case_ID']),
-                case_type=row['Case_Type'],
-                region=row['Region'],
-                priority=row['Priority'],
-                points=int(row['Points']),
-                date_filled=row['Date_Filled'],
-                description=row['Description'],
-            )
-
-        player.subsession.session.vars['num_cases'] = num_cases
+        with upload.open() as f:
+            result, _, _ = ingest_cases(Case, player.subsession, f)
+        discard_upload(player)
+        player.csv_rows = result['rows']
+        player.subsession.session.vars['ingest'] = result
+        player.subsession.session.vars['num_cases'] = result['rows']
+        descriptions.discard_subsession(player.subsession)
 
     @staticmethod
     def is_displayed(player: Player):
@@ -202,10 +316,12 @@ class AdminReview(Page):
         return player.participant.vars.get('role') == 'admin'
 
     @staticmethod
+    @timed
     def vars_for_template(player: Player):
         return {
-            'cases': Case.filter(subsession=player.subsession),
-            'num_cases': player.subsession.session.vars['num_cases']
+            'cases': Case.filter(subsession=player.subsession, retired=False),
+            'num_cases': player.subsession.session.vars['num_cases'],
+            'ingest': player.subsession.session.vars.get('ingest'),
         }
 
 
@@ -214,21 +330,25 @@ class Bid(Page):
     Batch Algorithm
     """
     form_model = 'player'
+    form_fields = ['bids']
+    live_method = bid_live_method
 
     @staticmethod
     def is_displayed(player: Player):
         return player.participant.vars.get('role') == 'judge'
 
     @staticmethod
-    def get_form_fields(player: Player):
-        cases = Case.filter(subsession=player.subsession)
-        cases_sorted = sorted(cases, key=lambda c: c.case_id)
-        form_fields = [f"bid_case_{c.case_id}" for c in cases_sorted]
-        return form_fields
+    def error_message(player: Player, values):
+        case_ids = Case.objects_filter(subsession=player.subsession, retired=False).with_entities(Case.case_id)
+        try:
+            parse_bids(values['bids'], {case_id for (case_id,) in case_ids})
+        except ValueError as exc:
+            return str(exc)
 
     @staticmethod
+    @timed
     def vars_for_template(player: Player):
-        cases = Case.filter(subsession=player.subsession)
+        cases = Case.filter(subsession=player.subsession, retired=False)
         cases_sorted = sorted(cases, key=lambda c: c.case_id)
 
         data_for_template = []
@@ -240,8 +360,6 @@ class Bid(Page):
                 'priority': c.priority,
                 'points': c.points,
                 'date_filled': c.date_filled,
-                'description': c.description,
-                'form_field_name': f"bid_case_{c.case_id}",
             })
 
         return {
@@ -252,18 +370,35 @@ class Bid(Page):
         }
 
     @staticmethod
+    @timed
     def before_next_page(player: Player, timeout_happened):
-        cases = Case.filter(subsession=player.subsession)
-        for c in cases:
-            field_name = f"bid_case_{c.case_id}"
-            bid_amount = player.field_maybe_none(field_name)
-            if bid_amount is not None:
-                CaseBid.create(
-                    subsession=player.subsession,
-                    case=c,
-                    player=player,
-                    bid_amount=bid_amount,
-                )
+        """
+        Stores the bids with one executemany INSERT. A resubmitted page
+        replaces the player's earlier bids, so clearing never counts a bid
+        twice. The submitted JSON is then cleared, so CaseBid is the only
+        copy of the bids.
+        """
+        subsession = player.subsession
+        # case_id -> primary key
+        case_pks = dict(
+            Case.objects_filter(subsession=subsession, retired=False).with_entities(Case.case_id, Case.id)
+        )
+        bids = parse_bids(player.field_maybe_none('bids'), case_pks)
+        CaseBid.objects_filter(subsession=subsession, player=player).delete(synchronize_session=False)
+        if bids:
+            Case.objects_filter().session.execute(
+                CaseBid.__table__.insert(),
+                [
+                    {
+                        'subsession_id': subsession.id,
+                        'player_id': player.id,
+                        'case_id': case_pks[case_id],
+                        'bid_amount': bid_amount,
+                    }
+                    for case_id, bid_amount in bids.items()
+                ],
+            )
+        player.bids = ''
 
 
 class ResultsWaitPage(WaitPage):
@@ -288,6 +423,7 @@ class Results(Page):
         return player.participant.vars.get('role') == 'judge'
 
     @staticmethod
+    @timed
     def vars_for_template(player: Player):
         assigned_case_ids_str = player.field_maybe_none('assigned_case_ids') or "[]"
         assigned_cases = json.loads(assigned_case_ids_str)
@@ -299,6 +435,10 @@ class Results(Page):
         }
 
 
+def vars_for_admin_report(subsession: Subsession):
+    return {'metrics': metrics_summary()}
+
+
 page_sequence = [
     Login,
     Admin,
@@ -0,0 +1,105 @@
+from otree.api import Bot, Submission, expect
+from . import *
+from common.clearing import clear_lowest_bids
+import hashlib
+import numpy as np
+
+
+CSV = open('demo.csv').read()
+
+# id_in_group -> {case_id: bid}. Everyone bids 3 on case 1 and 5 on
+# case 3, so those are three-way ties; case 2 goes to judge 2.
+BIDS = {
+    2: {1: 3, 2: 2, 3: 5},
+    3: {1: 3, 2: 3, 3: 5},
+    4: {1: 3, 2: 4, 3: 5},
+}
+# call_live_method bids on this case and then retires it, as a re-upload
+# that drops it would
+RETIRED_CASE_ID = 19
+
+
+class PlayerBot(Bot):
+    def play_round(self):
+        if self.player.id_in_group == 1:
+            yield Login, dict(username='admin', password='admin')
+            yield Submission(Admin, dict(csv_sha256=hashlib.sha256(CSV.encode()).hexdigest()), check_html=False)
+            yield AdminReview
+        else:
+            yield Login, dict(username=f'judge{self.player.id_in_group}', password='judge')
+            bids = BIDS[self.player.id_in_group]
+            yield Bid, dict(bids=json.dumps(bids))
+            # replaces the bids call_live_method stored for this player
+            # rather than adding to them
+            stored = CaseBid.filter(subsession=self.subsession, player=self.player)
+            expect(sorted((b.case.case_id, b.bid_amount) for b in stored), sorted(bids.items()))
+            expect(self.player.bids, '')
+
+            # the allocation is what clearing the stored bids again with
+            # the session's seed gives
+            cases = {c.case_id: c for c in Case.filter(subsession=self.subsession)}
+            expect(cases[RETIRED_CASE_ID].is_assigned, False)
+            expect(cases[2].assigned_judge.player.id_in_group, 2)
+            case_ids = {c.id: c.case_id for c in cases.values() if not c.retired}
+            rows = (
+                CaseBid.objects_filter(subsession=self.subsession)
+                .order_by(CaseBid.id)
+                .with_entities(CaseBid.case_id, CaseBid.player_id, CaseBid.bid_amount)
+                .all()
+            )
+            rng = clearing_rng(clearing_seed(self.session), self.round_number)
+            case_pks, winners, prices, ties = clear_case_bids(rows, case_ids, rng)
+            for case_pk, winner, price, tie_count in zip(case_pks, winners, prices, ties):
+                case = cases[case_ids[case_pk]]
+                if winner == NO_WINNER:
+                    expect(case.is_assigned, False)
+                    continue
+                expect(case.assigned_judge.player.id, winner)
+                expect((price, tie_count), {1: (3, 3), 2: (2, 1), 3: (5, 3)}[case.case_id])
+            won = sorted(c.case_id for c in cases.values() if c.is_assigned and c.assigned_judge.player == self.player)
+            expect(json.loads(self.player.field_maybe_none('assigned_case_ids') or '[]'), won)
+            yield Results
+
+
+def call_live_method(method, page_class, group, **kwargs):
+    if page_class == Admin:
+        method(1, {'action': 'upload_start'})
+        method(1, {'action': 'upload_chunk', 'seq': 0, 'data': CSV})
+        method(1, {'action': 'upload_end'})
+        return
+
+    # a fixed seed gives the same winners, prices and tie counts; cases 0
+    # and 2 are three-way ties, case 3 has no bids
+    bids = ([0, 0, 0, 1, 1, 2, 2, 2], [7, 8, 9, 7, 8, 7, 8, 9], [3, 3, 3, 2, 4, 5, 5, 5])
+    winners, prices, ties = clear_lowest_bids(*bids, 4, rng=42)
+    for again, first in zip(clear_lowest_bids(*bids, 4, rng=42), (winners, prices, ties)):
+        expect(np.array_equal(again, first, equal_nan=True), True)
+    expect(winners[1], 7)
+    expect(winners[3], NO_WINNER)
+    expect(np.isin(winners[[0, 2]], [7, 8, 9]).all(), True)
+    expect(prices[:3].tolist(), [3, 2, 5])
+    expect(np.isnan(prices[3]), True)
+    expect(ties.tolist(), [3, 1, 3, 0])
+    # and each tied bidder can win
+    expect({int(clear_lowest_bids(*bids, 4, rng=seed)[0][0]) for seed in range(100)}, {7, 8, 9})
+
+    # bids on cases that aren't on offer are left out of clearing
+    case_pks, winners, prices, ties = clear_case_bids([(10, 7, 3), (99, 8, 1), (11, 8, 2)], {10: 1, 11: 2}, rng=0)
+    expect((case_pks.tolist(), winners.tolist(), ties.tolist()), ([10, 11], [7, 8], [1, 1]))
+
+    # the lowest bid on a case that is then retired; set_assignments
+    # must not hand it out
+    subsession = group.subsession
+    retired = Case.filter(subsession=subsession, case_id=RETIRED_CASE_ID)[0]
+    CaseBid.create(subsession=subsession, player=group.get_player_by_id(1), case=retired, bid_amount=C.BID_MIN)
+    retired.retired = True
+
+    # bids stored as if each judge had already submitted the page once
+    for player in group.get_players()[1:]:
+        player.bids = json.dumps({1: 9, 2: 9, 4: 9})
+        Bid.before_next_page(player, False)
+        expect(len(CaseBid.filter(subsession=subsession, player=player)), 3)
+
+    # ids that aren't integers are skipped, never raised on
+    expect(list(method(2, {'action': 'describe', 'case_ids': [1, 'x', None, 99]})[2]['descriptions']), [1])
+    expect(method(2, {'action': 'describe', 'case_ids': 'abc'})[2]['descriptions'], {})
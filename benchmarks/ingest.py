@@ -0,0 +1,136 @@
+"""
+Throughput of the Admin page's CSV import (common.ingest), in rows per
+second, on a generated CSV.
+
+Runs against an in-memory SQLite database with stand-ins for the apps'
+Subsession and Case models (same columns, and oTree's objects_filter),
+so it needs neither oTree nor a server. Measures validating the upload,
+the bulk import, re-importing the same file (nothing to write), and, on
+a sample, importing one ORM object per row as the apps used to.
+
+    python benchmarks/ingest.py [--rows 100000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import sqlalchemy as sa
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import relationship, sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.ingest import iter_cases, ingest_cases, RowErrors, validate_cases  # noqa: E402
+
+
+Base = declarative_base()
+Session = sessionmaker()
+db = None
+
+
+class Model(Base):
+    __abstract__ = True
+
+    @classmethod
+    def objects_filter(cls, *args, **kwargs):
+        return db.query(cls).filter(*args).filter_by(**kwargs)
+
+
+class Subsession(Model):
+    __tablename__ = 'subsession'
+    id = sa.Column(sa.Integer, primary_key=True)
+
+
+class Case(Model):
+    __tablename__ = 'case'
+    id = sa.Column(sa.Integer, primary_key=True)
+    subsession_id = sa.Column(sa.Integer, sa.ForeignKey('subsession.id'), index=True)
+    subsession = relationship(Subsession)
+    case_id = sa.Column(sa.Integer)
+    case_type = sa.Column(sa.String)
+    region = sa.Column(sa.String)
+    priority = sa.Column(sa.String)
+    points = sa.Column(sa.Integer)
+    date_filled = sa.Column(sa.String)
+    description = sa.Column(sa.Text)
+    content_hash = sa.Column(sa.String)
+    retired = sa.Column(sa.Boolean, default=False)
+    date_ordinal = sa.Column(sa.Integer)
+    priority_rank = sa.Column(sa.Integer)
+    region_code = sa.Column(sa.Integer)
+    case_type_code = sa.Column(sa.Integer)
+    is_assigned = sa.Column(sa.Boolean, default=False)
+
+
+def write_csv(path, rows):
+    rng = random.Random(0)
+    with open(path, 'w', newline='') as f:
+        f.write('Case_ID,Case_Type,Region,Priority,Points,Date_Filled,Description\n')
+        for case_id in range(1, rows + 1):
+            f.write(
+                f'{case_id},{rng.choice(["Bail", "Civil", "Criminal", "Family"])},'
+                f'{rng.choice(["Karachi", "Lahore", "Sukkur", "Quetta"])},'
+                f'{rng.choice(["High", "Medium", "Low "])},{rng.randint(100, 1500)},'
+                f'"{rng.choice(["Jan", "Feb", "Mar", "Apr"])} {rng.randint(1, 28):02d}, {rng.randint(2000, 2020)}",'
+                f'Case {case_id} description\n'
+            )
+
+
+def fresh_database():
+    global db
+    engine = sa.create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    db = Session(bind=engine)
+    subsession = Subsession(id=1)
+    db.add(subsession)
+    db.flush()
+    return subsession
+
+
+def timed(label, rows, func):
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    print(f'{label:<32}{rows:>10}{seconds:>10.2f}{rows / seconds:>14,.0f}')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--per-row-sample', type=int, default=5_000,
+                        help='rows imported one ORM object at a time (default 5000)')
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'cases.csv')
+    write_csv(path, args.rows)
+    print(f"{'':<32}{'rows':>10}{'seconds':>10}{'rows/second':>14}")
+
+    with open(path, newline='') as f:
+        timed('validate', args.rows, lambda: validate_cases(f))
+
+    subsession = fresh_database()
+    with open(path, newline='') as f:
+        timed('bulk import', args.rows, lambda: ingest_cases(Case, subsession, f))
+    with open(path, newline='') as f:
+        summary, _, _ = timed('re-import, unchanged', args.rows, lambda: ingest_cases(Case, subsession, f))
+    assert summary['unchanged'] == args.rows, summary
+
+    subsession = fresh_database()
+
+    def per_row():
+        with open(path, newline='') as f:
+            for i, case in enumerate(iter_cases(f, RowErrors())):
+                if i == args.per_row_sample:
+                    break
+                db.add(Case(subsession=subsession, **case))
+                db.flush()
+
+    timed('one ORM object per row', min(args.per_row_sample, args.rows), per_row)
+
+
+if __name__ == '__main__':
+    main()
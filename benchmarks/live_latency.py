@@ -0,0 +1,154 @@
+"""
+Per-message cost of the greedy live actions as the case pool grows.
+
+Runs the in-memory work each live message does against pools of 20 to
+200,000 synthetic cases, and prints the median time per message: once
+with the whole pool free and once with 95% of it already assigned, as
+late in a session. A select goes through greedy.select_cases (budget
+check, claim, and re-encoding the player's stored selection) on a stand-in
+player, for a judge holding 20 cases and one holding up to 10,000; the
+others are a filtered first page, a first page with a points limit, the
+next page and a delta sync. The times should stay flat as the pool grows;
+a select also costs more the more cases the judge holds (up to half the
+free pool here), since their stored selection is patched in place.
+
+    python benchmarks/live_latency.py
+"""
+import os
+import random
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.case_index import CaseIndex, date_ordinal, priority_rank, PRIORITIES  # noqa: E402
+from common.broadcast import EventBatcher  # noqa: E402
+from common.claims import ClaimTable  # noqa: E402
+from greedy import Player, select_cases, unselect_cases  # noqa: E402
+
+
+POOL_SIZES = (20, 200, 2000, 20000, 200000)
+ASSIGNED_SHARES = (0, 0.95)
+MESSAGES = 2000
+# how many cases the selecting judge already holds
+HELD_CASES = (20, 10000)
+REGIONS = ('Karachi', 'Lahore', 'Sukkur', 'Quetta', 'Peshawar')
+CASE_TYPES = ('Bail', 'Civil', 'Criminal', 'Family')
+
+
+def make_cases(n, rng):
+    cases = []
+    for case_id in range(1, n + 1):
+        date_filled = f'Feb {rng.randint(1, 28):02d}, {rng.randint(2000, 2020)}'
+        priority = rng.choice(PRIORITIES)
+        region = rng.choice(REGIONS)
+        case_type = rng.choice(CASE_TYPES)
+        cases.append(SimpleNamespace(
+            case_id=case_id,
+            case_type=case_type,
+            region=region,
+            priority=priority,
+            points=rng.randint(1, 100),
+            date_filled=date_filled,
+            date_ordinal=date_ordinal(date_filled),
+            priority_rank=priority_rank(priority),
+            region_code=REGIONS.index(region) + 1,
+            case_type_code=CASE_TYPES.index(case_type) + 1,
+            is_assigned=False,
+            assigned_judge_id=None,
+        ))
+    return cases
+
+
+def median_us(func, args_list):
+    times = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1_000_000
+
+
+class StubPlayer:
+    """The Player fields select_cases uses, with the real selection property"""
+    selection = Player.selection
+
+    def __init__(self, case_ids, index):
+        self.id_in_group = 1
+        self.selected_case_ids = ''
+        self.selection = case_ids
+        self.committed_points = sum(index.get(cid).points for cid in case_ids)
+        # room for any one more case
+        self.budget = self.committed_points + 100
+
+
+def select_us(n, index, held, rng):
+    """
+    Median time of a select_cases that succeeds, by a judge holding held
+    free cases (at most half of them); each select is undone, untimed
+    """
+    claims = ClaimTable(lease_seconds=300)
+    batcher = EventBatcher()
+    free = [cid for cid in range(1, n + 1) if not index.is_assigned(cid)]
+    rng.shuffle(free)
+    held = min(held, len(free) // 2)
+    player = StubPlayer(free[:held], index)
+    times = []
+    for case_id in rng.choices(free[held:], k=MESSAGES):
+        start = time.perf_counter()
+        select_cases(player, [case_id], index, claims, batcher)
+        times.append(time.perf_counter() - start)
+        unselect_cases(player, [case_id], index, claims, batcher)
+    return statistics.median(times) * 1_000_000
+
+
+def bench(n, assigned_share, rng):
+    index = CaseIndex(make_cases(n, rng))
+    index.assign_many(rng.sample(range(1, n + 1), int(n * assigned_share)), 2)
+    results = {f'select@{held}': select_us(n, index, held, rng) for held in HELD_CASES}
+
+    def first_page(region):
+        return index.query(filters={'region': region}, sort='points', limit=24)
+
+    def points_limit(max_points):
+        return index.query(sort='date', max_points=max_points, limit=24)
+
+    _, cursor = index.query(sort='date', limit=24)
+
+    def next_page():
+        return index.query(sort='date', cursor=cursor, limit=24)
+
+    # a client a few changes behind
+    version = index.version
+    for case_id in rng.sample(range(1, n + 1), min(5, n)):
+        index.assign(case_id, 1)
+        index.release(case_id)
+
+    def sync():
+        return index.changes_since(version)
+
+    return dict(
+        results,
+        query=median_us(first_page, [(rng.choice(REGIONS),) for _ in range(MESSAGES)]),
+        max_points=median_us(points_limit, [(rng.randint(5, 20),) for _ in range(MESSAGES)]),
+        page=median_us(next_page, [()] * MESSAGES),
+        sync=median_us(sync, [()] * MESSAGES),
+    )
+
+
+def main():
+    rng = random.Random(0)
+    for assigned_share in ASSIGNED_SHARES:
+        results = {n: bench(n, assigned_share, rng) for n in POOL_SIZES}
+        actions = list(results[POOL_SIZES[0]])
+        print(f'{assigned_share:.0%} of the pool assigned')
+        print(f"{'cases':>8}" + ''.join(f'{action:>14}' for action in actions) + '   (median us/message)')
+        for n, row in results.items():
+            print(f'{n:>8}' + ''.join(f'{row[action]:>14.1f}' for action in actions))
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Microbenchmark of CaseSelection against the JSON list selections used to
+be stored as, for a judge holding 10,000 of a 20,000-case pool.
+
+Measures membership tests, adding and removing a case, decoding and
+encoding the stored value, the stored size, and a whole select click as
+the live method does it: read the player's selection, add the case, store
+the new value and read it back.
+
+    python benchmarks/selection.py
+"""
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.selection import CaseSelection, _decode, remember  # noqa: E402
+
+
+POOL = 20_000
+SELECTED = 10_000
+
+
+def per_call_us(stmt, number):
+    return min(timeit.repeat(stmt, number=number, repeat=5)) / number * 1_000_000
+
+
+def main():
+    rng = random.Random(0)
+    ids = sorted(rng.sample(range(1, POOL + 1), SELECTED))
+    probes = [rng.randint(1, POOL) for _ in range(1000)]
+    # a case that isn't selected, to add and remove
+    spare = next(cid for cid in range(1, POOL + 1) if cid not in set(ids))
+
+    as_list = list(ids)
+    as_json = json.dumps(as_list)
+    selection = CaseSelection(ids)
+    encoded = selection.encode()
+
+    def list_membership():
+        for cid in probes:
+            cid in as_list
+
+    def selection_membership():
+        for cid in probes:
+            cid in selection
+
+    def list_add_remove():
+        as_list.append(spare)
+        as_list.remove(spare)
+
+    def json_click():
+        # as the live method did with a JSON list field
+        case_ids = json.loads(as_json)
+        if spare not in case_ids:
+            case_ids.append(spare)
+        stored = json.dumps(case_ids)
+        json.loads(stored)
+
+    def selection_click():
+        # as Player.selection's getter and setter do
+        current = CaseSelection.decode(encoded)
+        new = current.add([spare])
+        stored = new.encode()
+        remember(stored, new)
+        CaseSelection.decode(stored)
+
+    rows = [
+        ('membership (per test)', per_call_us(list_membership, 20) / len(probes),
+         per_call_us(selection_membership, 20) / len(probes)),
+        ('add + remove one case', per_call_us(list_add_remove, 200),
+         per_call_us(lambda: selection.add([spare]).remove([spare]).encode(), 200)),
+        ('decode stored value', per_call_us(lambda: json.loads(as_json), 50),
+         per_call_us(lambda: _decode(encoded), 50)),
+        ('decode (cached)', None, per_call_us(lambda: CaseSelection.decode(encoded), 2000)),
+        ('encode', per_call_us(lambda: json.dumps(as_list), 50),
+         per_call_us(lambda: CaseSelection._from_sorted(ids).encode(), 50)),
+        ('select click', per_call_us(json_click, 50), per_call_us(selection_click, 200)),
+    ]
+    print(f'{SELECTED} of {POOL} cases selected')
+    print(f"{'':<24}{'JSON list':>14}{'CaseSelection':>16}   (us)")
+    for name, old, new in rows:
+        old = '-' if old is None else f'{old:.2f}'
+        print(f'{name:<24}{old:>14}{new:>16.2f}')
+    print(f"{'stored size (KB)':<24}{len(as_json) / 1024:>14.1f}{len(encoded) / 1024:>16.1f}")
+
+
+if __name__ == '__main__':
+    main()
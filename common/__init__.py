@@ -0,0 +1,4 @@
+"""
+Helpers shared by the greedy and batch apps. Nothing in here defines
+oTree models, so each app passes in its own Case rows.
+"""
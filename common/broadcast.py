@@ -0,0 +1,59 @@
+"""
+Coalescing of events that every connected judge should see (e.g. another
+judge claiming a case).
+
+oTree can only send live messages in reply to an incoming message, so
+events are buffered per subsession and flushed, at most once per
+BROADCAST_WINDOW seconds, as a single batch per recipient on whichever
+message arrives next. Pages send a periodic 'ping' so a batch never waits
+for long.
+"""
+from collections import OrderedDict
+import time
+
+
+BROADCAST_WINDOW = 0.5
+
+
+class EventBatcher:
+    def __init__(self, window=BROADCAST_WINDOW):
+        self.window = window
+        self.last_flush = 0
+        # only the latest event per case is kept, so a claim followed by a
+        # release within one window goes out as just the release
+        self.pending = OrderedDict()
+        # id_in_group of every player who has sent a live message
+        self.recipients = set()
+
+    def connect(self, id_in_group):
+        self.recipients.add(id_in_group)
+
+    def disconnect(self, id_in_group):
+        self.recipients.discard(id_in_group)
+
+    def claim(self, case_id, id_in_group):
+        self.pending[case_id] = {'type': 'claim', 'case_id': case_id, 'judge': id_in_group}
+
+    def release(self, case_id, id_in_group):
+        self.pending[case_id] = {'type': 'release', 'case_id': case_id, 'judge': id_in_group}
+
+    def remove(self, case_id):
+        """The case has left the pool (it was assigned)"""
+        self.pending[case_id] = {'type': 'remove', 'case_id': case_id}
+
+    def pool_changed(self, version):
+        """
+        Cases were added or changed by an upload; clients behind version
+        catch up with a 'sync'
+        """
+        self.pending['pool'] = {'type': 'pool', 'version': version}
+
+    def flush(self, now=None):
+        """Returns the pending events if the window has passed, else None"""
+        now = time.monotonic() if now is None else now
+        if not self.pending or now - self.last_flush < self.window:
+            return None
+        events = list(self.pending.values())
+        self.pending.clear()
+        self.last_flush = now
+        return events
@@ -0,0 +1,552 @@
+"""
+In-memory index of the cases uploaded for a subsession, so that live
+methods and page hooks can look cases up by Case_ID without going
+through the ORM on every message.
+
+Descriptions are not kept in the index (they can be kilobytes each);
+pages fetch them on demand for the cards on screen, through a
+DescriptionCache.
+"""
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from datetime import datetime
+import heapq
+import html
+
+
+# How many pool changes are remembered for delta syncs. Clients that are
+# further behind than this get a full snapshot instead.
+CHANGE_LOG_SIZE = 1000
+
+# Max number of descriptions returned per 'describe' message, and how many
+# rendered descriptions each app keeps in memory.
+DESCRIBE_BATCH_SIZE = 50
+DESCRIPTION_CACHE_SIZE = 2000
+
+# Page size for the 'page' and 'query' live actions
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+# Sorted orderings are split into buckets of this many to twice this many
+# cases, so adding or removing one shifts a bucket, not the whole pool
+ORDERING_BUCKET_SIZE = 512
+
+# assign_many() and release_many() rebuild the orderings rather than update
+# them case by case once they change more than 1/REBUILD_SHARE of the cases
+# (an update costs several times what a case costs in a rebuild)
+REBUILD_SHARE = 8
+
+
+# Fields judges can filter on with 'query', and the integer column each
+# is indexed by
+FILTER_CODES = {
+    'region': 'region_code',
+    'case_type': 'case_type_code',
+    'priority': 'priority_rank',
+}
+FILTER_FIELDS = tuple(FILTER_CODES)
+
+CASE_FIELDS = (
+    'case_id',
+    'case_type',
+    'region',
+    'priority',
+    'points',
+    'date_filled',
+)
+
+# Integer columns derived from the fields above when cases are ingested
+# (see common.ingest), so sorting and filtering never re-parse strings.
+# They stay on the server; clients only get CASE_FIELDS.
+DERIVED_FIELDS = (
+    'date_ordinal',
+    'priority_rank',
+    'region_code',
+    'case_type_code',
+)
+
+PRIORITIES = ('High', 'Medium', 'Low')
+PRIORITY_RANKS = {priority: rank for rank, priority in enumerate(PRIORITIES, start=1)}
+
+
+class CaseSnapshot:
+    """
+    Read-only copy of a Case row, minus its description. It is safe to
+    keep between requests, unlike the ExtraModel instance it came from.
+    """
+    __slots__ = CASE_FIELDS + DERIVED_FIELDS
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            object.__setattr__(self, name, values[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"CaseSnapshot is read-only (tried to set '{name}')")
+
+    @classmethod
+    def from_case(cls, case):
+        return cls(**{name: getattr(case, name) for name in cls.__slots__})
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in CASE_FIELDS}
+
+
+def date_ordinal(date_filled):
+    """'Feb 24, 2009' -> day number, or 0 if the date can't be parsed"""
+    try:
+        return datetime.strptime(date_filled.strip(), '%b %d, %Y').toordinal()
+    except (AttributeError, ValueError):
+        return 0
+
+
+def priority_rank(priority):
+    """'High' -> 1, 'Medium' -> 2, 'Low' -> 3; anything else sorts after them"""
+    return PRIORITY_RANKS.get(priority, len(PRIORITIES) + 1)
+
+
+# Orderings judges can browse by. Every key ends with case_id so it is
+# unique and can be used as a pagination cursor.
+SORT_KEYS = {
+    'case_id': lambda c: (c.case_id,),
+    'points': lambda c: (c.points, c.case_id),
+    'date': lambda c: (c.date_ordinal, c.case_id),
+    'priority': lambda c: (c.priority_rank, c.case_id),
+}
+
+
+class SortedCases:
+    """
+    Cases kept sorted by key(case), in buckets (see ORDERING_BUCKET_SIZE)
+    with the largest key of each bucket alongside, so a case can be found,
+    added or removed with two bisects and a short list shift.
+    """
+
+    def __init__(self, key, cases=(), presorted=False):
+        self.key = key
+        if not presorted:
+            cases = sorted(cases, key=key)
+        keys = [key(c) for c in cases]
+        size = ORDERING_BUCKET_SIZE
+        self.keys = [keys[i:i + size] for i in range(0, len(keys), size)]
+        self.values = [cases[i:i + size] for i in range(0, len(cases), size)]
+        self.maxes = [bucket[-1] for bucket in self.keys]
+        self.size = len(keys)
+
+    def __len__(self):
+        return self.size
+
+    def width(self):
+        """Length of this ordering's keys (0 if it is empty)"""
+        return len(self.keys[0][0]) if self.keys else 0
+
+    def add(self, case):
+        key = self.key(case)
+        if not self.keys:
+            self.keys.append([key])
+            self.values.append([case])
+            self.maxes.append(key)
+            self.size = 1
+            return
+        b = min(bisect_left(self.maxes, key), len(self.maxes) - 1)
+        keys = self.keys[b]
+        i = bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            return
+        keys.insert(i, key)
+        self.values[b].insert(i, case)
+        self.maxes[b] = keys[-1]
+        self.size += 1
+        if len(keys) > 2 * ORDERING_BUCKET_SIZE:
+            half = len(keys) // 2
+            values = self.values[b]
+            self.keys[b + 1:b + 1] = [keys[half:]]
+            self.values[b + 1:b + 1] = [values[half:]]
+            del keys[half:]
+            del values[half:]
+            self.maxes[b:b + 1] = [keys[-1], self.keys[b + 1][-1]]
+
+    def remove(self, case):
+        key = self.key(case)
+        b = bisect_left(self.maxes, key)
+        if b == len(self.maxes):
+            return
+        keys = self.keys[b]
+        i = bisect_left(keys, key)
+        if i == len(keys) or keys[i] != key:
+            return
+        del keys[i]
+        del self.values[b][i]
+        self.size -= 1
+        if keys:
+            self.maxes[b] = keys[-1]
+        else:
+            del self.keys[b], self.values[b], self.maxes[b]
+
+    def rank(self, key):
+        """How many cases sort before key"""
+        b = bisect_left(self.maxes, key)
+        if b == len(self.maxes):
+            return self.size
+        return sum(map(len, self.keys[:b])) + bisect_left(self.keys[b], key)
+
+    def iter_from(self, key=None, inclusive=False):
+        """
+        Yields the cases in order, starting after key (at key if
+        inclusive), or from the first if key is None
+        """
+        find = bisect_left if inclusive else bisect_right
+        b = i = 0
+        if key is not None:
+            b = find(self.maxes, key)
+            if b == len(self.maxes):
+                return
+            i = find(self.keys[b], key)
+        for values in self.values[b:]:
+            for j in range(i, len(values)):
+                yield values[j]
+            i = 0
+
+
+def cursor_key(cursor, width):
+    """
+    A client's cursor as a sort key (a tuple of `width` ints), or None if
+    it isn't one.
+    """
+    if not isinstance(cursor, (list, tuple)) or len(cursor) != width or not width:
+        return None
+    try:
+        return tuple(int(value) for value in cursor)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+class CaseIndex:
+    """
+    case_id -> CaseSnapshot for one subsession, plus which Judge (by
+    primary key) each case is currently assigned to.
+
+    The pool of unassigned cases is versioned: every assign/release bumps
+    `version` and is recorded in a bounded change log, so clients can ask
+    for what changed since the version they last saw.
+
+    For browsing, every sort order in SORT_KEYS is kept for the unassigned
+    cases, both over all of them and per code of each FILTER_FIELDS field,
+    so a page is a bisect plus a short walk rather than a scan of the pool,
+    comparing integers only. Cases leave the orderings when they are
+    assigned and return when released, so a page never walks past cases
+    that can't be shown, however much of the pool is taken.
+    """
+
+    def __init__(self, cases, version=0):
+        self.cases = {}
+        self.assigned_judge = {}
+        self.judge_cases = {}
+        self.version = version
+        self.changes = deque(maxlen=CHANGE_LOG_SIZE)
+        # oldest client version we can still compute a delta from
+        self.log_start = version
+        for c in cases:
+            self.cases[c.case_id] = CaseSnapshot.from_case(c)
+            if c.is_assigned:
+                self._link(c.case_id, c.assigned_judge_id)
+        self._build_orderings()
+
+    def _build_orderings(self):
+        # field -> {value: code}, to translate the values clients filter on
+        self.codes = {field: {} for field in FILTER_FIELDS}
+        for c in self.cases.values():
+            for field, code in FILTER_CODES.items():
+                self.codes[field][getattr(c, field)] = getattr(c, code)
+
+        # (sort, field, code) -> SortedCases of the unassigned cases; field
+        # and code are None for the ordering over all of them.
+        self.orderings = {}
+        unassigned = self.unassigned()
+        for sort, key in SORT_KEYS.items():
+            ordered = sorted(unassigned, key=key)
+            groups = {(sort, None, None): ordered}
+            for field, code in FILTER_CODES.items():
+                for c in ordered:
+                    groups.setdefault((sort, field, getattr(c, code)), []).append(c)
+            for group_key, group in groups.items():
+                self.orderings[group_key] = SortedCases(key, group, presorted=True)
+
+    def _ordering_keys(self, c):
+        for sort in SORT_KEYS:
+            yield sort, None, None
+            for field, code in FILTER_CODES.items():
+                yield sort, field, getattr(c, code)
+
+    def _add_to_orderings(self, c):
+        for ordering_key in self._ordering_keys(c):
+            ordering = self.orderings.get(ordering_key)
+            if ordering is None:
+                ordering = self.orderings[ordering_key] = SortedCases(SORT_KEYS[ordering_key[0]])
+            ordering.add(c)
+
+    def _remove_from_orderings(self, c):
+        for ordering_key in self._ordering_keys(c):
+            ordering = self.orderings.get(ordering_key)
+            if ordering is not None:
+                ordering.remove(c)
+
+    def _smallest_ordering(self, sort, codes):
+        """The smallest ordering for sort that satisfies one of the filters"""
+        ordering = self.orderings[sort, None, None]
+        for field, (_, code) in codes.items():
+            candidate = self.orderings.get((sort, field, code))
+            if candidate is None:
+                return SortedCases(SORT_KEYS[sort])
+            if len(candidate) < len(ordering):
+                ordering = candidate
+        return ordering
+
+    def _points_range(self, sort, codes, min_points, max_points, cursor, limit):
+        """
+        For a points range on another sort order: the first limit + 1
+        matching cases after cursor, in sort order, taken from the cases in
+        the range; or None if walking the sort order is expected to be
+        cheaper. Collecting costs the size k of the range, while a walk
+        passes about limit * n / k cases to find limit in it, so the range
+        is collected when k * k <= limit * n and neither costs more than
+        sqrt(limit * n).
+        """
+        ordering = self._smallest_ordering('points', codes)
+        start = 0 if min_points is None else ordering.rank((min_points,))
+        end = len(ordering) if max_points is None else ordering.rank((max_points + 1,))
+        in_range = end - start
+        walked = len(self._smallest_ordering(sort, codes))
+        if in_range * in_range > limit * walked:
+            return None
+        key = SORT_KEYS[sort]
+        cases = []
+        for c in ordering.iter_from(None if min_points is None else (min_points,), inclusive=True):
+            if max_points is not None and c.points > max_points:
+                break
+            if cursor is not None and key(c) <= cursor:
+                continue
+            if any(getattr(c, column) != code for column, code in codes.values()):
+                continue
+            cases.append(c)
+        return heapq.nsmallest(limit + 1, cases, key=key)
+
+    def facets(self):
+        """Values judges can filter on, per field (priorities by rank)"""
+        facets = {field: sorted(self.codes[field]) for field in FILTER_FIELDS}
+        facets['priority'].sort(key=self.codes['priority'].get)
+        return facets
+
+    def query(self, filters=None, sort='case_id', min_points=None, max_points=None,
+              cursor=None, limit=DEFAULT_PAGE_SIZE):
+        """
+        Returns (cases, next_cursor) for one page of unassigned cases.
+        next_cursor is None when there are no more pages.
+
+        Arguments come from clients: an unknown sort, filters that aren't
+        a dict (or values that aren't strings) and a cursor that isn't a
+        key of this sort are all ignored.
+        """
+        if not isinstance(sort, str) or sort not in SORT_KEYS:
+            sort = 'case_id'
+        if not isinstance(filters, dict):
+            filters = {}
+        # filter values -> (code column, code)
+        codes = {}
+        for field, value in filters.items():
+            if field in FILTER_FIELDS and value and isinstance(value, str):
+                if value not in self.codes[field]:
+                    return [], None
+                codes[field] = (FILTER_CODES[field], self.codes[field][value])
+
+        key = SORT_KEYS[sort]
+        # walk the smallest ordering that satisfies one of the filters
+        ordering = self._smallest_ordering(sort, codes)
+        cursor = cursor_key(cursor, ordering.width())
+
+        cases = None
+        if sort != 'points' and (min_points is not None or max_points is not None):
+            cases = self._points_range(sort, codes, min_points, max_points, cursor, limit)
+        if cases is None:
+            start, inclusive = cursor, False
+            if sort == 'points' and min_points is not None and (cursor is None or cursor < (min_points,)):
+                start, inclusive = (min_points,), True
+            cases = ordering.iter_from(start, inclusive)
+
+        page = []
+        for c in cases:
+            if max_points is not None and c.points > max_points:
+                if sort == 'points':
+                    break
+                continue
+            if min_points is not None and c.points < min_points:
+                continue
+            if any(getattr(c, column) != code for column, code in codes.values()):
+                continue
+            if len(page) == limit:
+                return page, list(key(page[-1]))
+            page.append(c)
+        return page, None
+
+    def __len__(self):
+        return len(self.cases)
+
+    def __contains__(self, case_id):
+        return case_id in self.cases
+
+    def get(self, case_id):
+        return self.cases.get(case_id)
+
+    def all(self):
+        return list(self.cases.values())
+
+    def unassigned(self):
+        return [c for cid, c in self.cases.items() if cid not in self.assigned_judge]
+
+    def is_assigned(self, case_id):
+        return case_id in self.assigned_judge
+
+    def assigned_ids(self, judge_pk):
+        return set(self.judge_cases.get(judge_pk, ()))
+
+    def assigned_to(self, judge_pk):
+        return [self.cases[cid] for cid in sorted(self.judge_cases.get(judge_pk, ()))]
+
+    def assign(self, case_id, judge_pk):
+        if case_id not in self.assigned_judge and case_id in self.cases:
+            self._remove_from_orderings(self.cases[case_id])
+        self._unlink(case_id)
+        self._link(case_id, judge_pk)
+        self._log_change(case_id)
+
+    def release(self, case_id):
+        if case_id in self.assigned_judge:
+            self._unlink(case_id)
+            if case_id in self.cases:
+                self._add_to_orderings(self.cases[case_id])
+            self._log_change(case_id)
+
+    def assign_many(self, case_ids, judge_pk):
+        """assign() for many cases, e.g. a judge's whole submission"""
+        case_ids = list(case_ids)
+        if len(case_ids) * REBUILD_SHARE < len(self.cases):
+            for case_id in case_ids:
+                self.assign(case_id, judge_pk)
+            return
+        for case_id in case_ids:
+            self._unlink(case_id)
+            self._link(case_id, judge_pk)
+            self._log_change(case_id)
+        self._build_orderings()
+
+    def release_many(self, case_ids):
+        """release() for many cases"""
+        case_ids = [case_id for case_id in case_ids if case_id in self.assigned_judge]
+        if len(case_ids) * REBUILD_SHARE < len(self.cases):
+            for case_id in case_ids:
+                self.release(case_id)
+            return
+        for case_id in case_ids:
+            self._unlink(case_id)
+            self._log_change(case_id)
+        self._build_orderings()
+
+    def apply(self, upserted=(), removed=()):
+        """
+        Adds or replaces the given Case rows and drops the cases in
+        removed (case_ids), e.g. after a re-upload. Each is logged as a
+        change, so clients pick them up with changes_since().
+        """
+        for c in upserted:
+            self.cases[c.case_id] = CaseSnapshot.from_case(c)
+            self._log_change(c.case_id)
+        for case_id in removed:
+            if self.cases.pop(case_id, None) is not None:
+                self._unlink(case_id)
+                self._log_change(case_id)
+        self._build_orderings()
+
+    def _link(self, case_id, judge_pk):
+        self.assigned_judge[case_id] = judge_pk
+        self.judge_cases.setdefault(judge_pk, set()).add(case_id)
+
+    def _unlink(self, case_id):
+        if case_id in self.assigned_judge:
+            judge_pk = self.assigned_judge.pop(case_id)
+            self.judge_cases[judge_pk].discard(case_id)
+
+    def _log_change(self, case_id):
+        if len(self.changes) == self.changes.maxlen:
+            self.log_start = self.changes[0][0]
+        self.version += 1
+        self.changes.append((self.version, case_id))
+
+    def changes_since(self, version):
+        """
+        Returns (updated, removed) for the unassigned pool since `version`,
+        or None if the change log no longer reaches back that far.
+        """
+        if version is None or not self.log_start <= version <= self.version:
+            return None
+        changed_ids = []
+        seen = set()
+        for v, case_id in reversed(self.changes):
+            if v <= version:
+                break
+            if case_id not in seen:
+                seen.add(case_id)
+                changed_ids.append(case_id)
+
+        updated = []
+        removed = []
+        for case_id in changed_ids:
+            if case_id in self.cases and case_id not in self.assigned_judge:
+                updated.append(self.cases[case_id])
+            else:
+                removed.append(case_id)
+        return updated, removed
+
+
+def render_description(description):
+    return html.escape(description or '').replace('\n', '<br>')
+
+
+class DescriptionCache:
+    """
+    LRU of rendered descriptions keyed by (subsession id, case_id).
+    `load(subsession, case_ids)` is called once per batch of misses and
+    should return {case_id: description}.
+    """
+
+    def __init__(self, load, maxsize=DESCRIPTION_CACHE_SIZE):
+        self.load = load
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+
+    def describe(self, subsession, case_ids):
+        case_ids = case_ids[:DESCRIBE_BATCH_SIZE]
+        result = {}
+        missing = []
+        for case_id in case_ids:
+            key = (subsession.id, case_id)
+            if key in self.items:
+                self.items.move_to_end(key)
+                result[case_id] = self.items[key]
+            else:
+                missing.append(case_id)
+
+        if missing:
+            for case_id, description in self.load(subsession, missing).items():
+                rendered = render_description(description)
+                self.items[(subsession.id, case_id)] = rendered
+                result[case_id] = rendered
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+        return result
+
+    def discard(self, subsession, case_ids):
+        for case_id in case_ids:
+            self.items.pop((subsession.id, case_id), None)
+
+    def discard_subsession(self, subsession):
+        for key in [key for key in self.items if key[0] == subsession.id]:
+            del self.items[key]
@@ -0,0 +1,81 @@
+"""
+Exclusive, leased claims on cases.
+
+A judge claims a case the moment they select it, so two judges can never
+hold the same case. Claims are held under a lease per judge rather than
+per case: anything the judge does renews all of their claims at once, and
+when a judge stops acting (closed tab, lost connection, or a tab left
+open without ever submitting) every claim they hold expires together and
+is released by the next sweep.
+
+Live methods run one at a time in oTree's event loop, so checking and
+taking a claim here is atomic without any locking.
+"""
+import time
+
+
+SWEEP_INTERVAL = 5
+
+
+class ClaimTable:
+    def __init__(self, lease_seconds, now=None):
+        self.lease_seconds = lease_seconds
+        # case_id -> holder (the judge's id_in_group)
+        self.claims = {}
+        # holder -> set of case_ids, and holder -> lease expiry time
+        self.held = {}
+        self.expires = {}
+        # bumped whenever the set of claimed cases changes
+        self.version = 0
+        self.last_sweep = time.monotonic() if now is None else now
+
+    def holder(self, case_id):
+        return self.claims.get(case_id)
+
+    def renew(self, holder, now=None):
+        now = time.monotonic() if now is None else now
+        self.expires[holder] = now + self.lease_seconds
+
+    def claim(self, case_id, holder, now=None):
+        """Takes the case for holder. Returns False if someone else has it."""
+        current = self.claims.get(case_id)
+        if current is not None and current != holder:
+            return False
+        if current is None:
+            self.claims[case_id] = holder
+            self.held.setdefault(holder, set()).add(case_id)
+            self.version += 1
+        self.renew(holder, now)
+        return True
+
+    def release(self, case_id, holder):
+        """Returns True if holder had the case and it is now free."""
+        if self.claims.get(case_id) != holder:
+            return False
+        del self.claims[case_id]
+        self.held[holder].discard(case_id)
+        self.version += 1
+        return True
+
+    def sweep(self, now=None):
+        """
+        Releases every claim whose holder's lease has run out, at most once
+        per SWEEP_INTERVAL. Returns {holder: [case_ids released]}.
+        """
+        now = time.monotonic() if now is None else now
+        if now - self.last_sweep < SWEEP_INTERVAL:
+            return {}
+        self.last_sweep = now
+        expired = {}
+        for holder, expiry in list(self.expires.items()):
+            if expiry > now:
+                continue
+            del self.expires[holder]
+            case_ids = self.held.pop(holder, set())
+            for case_id in case_ids:
+                del self.claims[case_id]
+            if case_ids:
+                expired[holder] = sorted(case_ids)
+        if expired:
+            self.version += 1
+        return expired
@@ -0,0 +1,101 @@
+"""
+Winner determination for the batch auction: each case goes to the judge
+who bid the least for it, with ties broken at random.
+
+clear_lowest_bids() works on whole arrays of bids with NumPy instead of
+looping over cases in Python, and doesn't touch the database, so it can
+be run (and checked) offline on bids exported from a session.
+
+Ties are broken with a random stream derived from a per-session seed
+(session.vars['clearing_seed']) and the round number, so an allocation
+can be reproduced from the stored bids; see common.replay.
+"""
+from itertools import chain
+import secrets
+
+import numpy as np
+
+
+NO_WINNER = -1
+
+
+def clear_lowest_bids(cases, bidders, amounts, n_cases, rng=None):
+    """
+    cases, bidders and amounts describe one bid each: the case's position
+    (0 to n_cases - 1), an integer identifying the bidder, and the amount.
+
+    Works in a few passes over the bid arrays, without sorting: the
+    lowest amount per case is found with an unbuffered minimum, the bids
+    at that amount get a random key each, and the one with the highest
+    key in its case wins, so each tied bid is equally likely to. rng is a
+    numpy.random.Generator or a seed for one; the same bids (in the same
+    order) and seed always give the same winners.
+
+    Returns three arrays of length n_cases: the winning bidder (NO_WINNER
+    for cases nobody bid on), the winning amount (NaN if none) and how
+    many bids tied for the lowest amount (0 if none).
+    """
+    cases = np.asarray(cases, dtype=np.int64)
+    bidders = np.asarray(bidders, dtype=np.int64)
+    amounts = np.asarray(amounts, dtype=np.float64)
+    rng = np.random.default_rng(rng)
+
+    winners = np.full(n_cases, NO_WINNER, dtype=np.int64)
+    prices = np.full(n_cases, np.nan)
+    ties = np.zeros(n_cases, dtype=np.int64)
+    if not len(cases):
+        return winners, prices, ties
+
+    prices[:] = np.inf
+    np.minimum.at(prices, cases, amounts)
+    lowest = np.flatnonzero(amounts == prices[cases])
+    tied_cases = cases[lowest]
+    ties += np.bincount(tied_cases, minlength=n_cases)
+
+    keys = rng.random(len(lowest))
+    best_keys = np.full(n_cases, -1.0)
+    np.maximum.at(best_keys, tied_cases, keys)
+    chosen = keys == best_keys[tied_cases]
+    winners[tied_cases[chosen]] = bidders[lowest[chosen]]
+    prices[ties == 0] = np.nan
+    return winners, prices, ties
+
+
+def clearing_seed(session):
+    """
+    The session's clearing seed: session.config['clearing_seed'] if set,
+    otherwise a random one. Chosen once and kept in session.vars.
+    """
+    if 'clearing_seed' not in session.vars:
+        seed = session.config.get('clearing_seed')
+        session.vars['clearing_seed'] = secrets.randbits(63) if seed is None else int(seed)
+    return session.vars['clearing_seed']
+
+
+def clearing_rng(seed, round_number):
+    """Independent random stream for each round of a session"""
+    return np.random.default_rng([seed, round_number])
+
+
+def clear_case_bids(bids, case_pks, rng):
+    """
+    Clears a round from its stored bids. bids is a sequence of (case
+    primary key, player id, amount) rows in the order the bids were made
+    (bids on cases not in case_pks, the cases on offer, are ignored).
+
+    Returns (case primary keys, winning player ids, winning amounts, tie
+    counts), one entry per case on offer; see clear_lowest_bids.
+    """
+    # fromiter, since np.array() would probe each database row as a
+    # possible array before reading it
+    bids = np.fromiter(chain.from_iterable(bids), dtype=np.float64, count=3 * len(bids)).reshape(-1, 3)
+    # the engine wants cases numbered 0..n-1: their position in case_pks
+    case_pks = np.array(sorted(case_pks), dtype=np.int64)
+    bid_cases = bids[:, 0].astype(np.int64)
+    positions = np.searchsorted(case_pks, bid_cases)
+    on_offer = positions < len(case_pks)
+    on_offer[on_offer] = case_pks[positions[on_offer]] == bid_cases[on_offer]
+    winners, prices, ties = clear_lowest_bids(
+        positions[on_offer], bids[on_offer, 1], bids[on_offer, 2], len(case_pks), rng=rng
+    )
+    return case_pks, winners, prices, ties
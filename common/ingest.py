@@ -0,0 +1,394 @@
+"""
+Bulk import of the cases CSV uploaded on the Admin page, shared by both
+apps. The functions here take the CSV as an iterable of lines: normally
+the temporary file the upload was streamed to (see common.upload), or
+iter_lines(text) for a CSV held in a string.
+
+Rows are checked against CASE_SCHEMA and converted in a single pass:
+every problem is collected (with its line number) instead of stopping at
+the first, enum values are normalized ('High ' -> 'High'), free-text
+values that are compared (Region, Case_Type) are folded to one spelling
+('lahore ' -> 'Lahore') and duplicate Case_IDs are rejected. Uploads are validated as soon as they arrive, so a
+file with problems is sent back to the admin with the list, and nothing
+is imported.
+
+An upload is diffed against the cases already in the subsession by
+Case_ID and a hash of each row's content, and only new and changed rows
+are written, CHUNK_SIZE at a time with a single executemany statement per
+chunk instead of one ORM object per row. Everything happens in the
+request's own transaction, which oTree commits once the page hook
+returns, so an upload is imported entirely or not at all.
+"""
+import csv
+from functools import lru_cache
+import hashlib
+import logging
+import time
+
+from sqlalchemy import bindparam
+
+from .case_index import date_ordinal, priority_rank
+
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1000
+
+# ids per UPDATE when retiring cases (SQLite allows 999 bound parameters)
+RETIRE_BATCH_SIZE = 500
+
+MAX_REPORTED_ERRORS = 100
+
+
+def iter_lines(text):
+    """Yields the lines of text (with their line endings) without copying it all"""
+    start = 0
+    while True:
+        end = text.find('\n', start)
+        if end == -1:
+            if start < len(text):
+                yield text[start:]
+            return
+        yield text[start:end + 1]
+        start = end + 1
+
+
+class Column:
+    """
+    One CSV column of the case schema: the Case field it fills, its header,
+    and a function turning the (whitespace-stripped, non-empty) text into
+    the stored value, raising ValueError with a short description of the
+    problem. Without a function, the stripped text is stored as is.
+
+    A fold column has no fixed set of values, but spellings of one value
+    that differ only in case or whitespace are stored as the first
+    spelling seen, the way one_of matches its choices.
+    """
+    __slots__ = ('field', 'header', 'coerce', 'required', 'unique', 'default', 'fold')
+
+    def __init__(self, field, header, coerce=None, required=False, unique=False, default='', fold=False):
+        self.field = field
+        self.header = header
+        self.coerce = coerce
+        self.required = required
+        self.unique = unique
+        self.default = default
+        self.fold = fold
+
+
+def whole_number(value):
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError('is not a whole number') from None
+    if number < 0:
+        raise ValueError('is negative')
+    return number
+
+
+def one_of(*choices):
+    """Matches choices ignoring case and extra whitespace ('High ' -> 'High')"""
+    canonical = {choice.lower(): choice for choice in choices}
+    message = 'is not one of ' + ', '.join(choices)
+
+    @lru_cache(maxsize=256)
+    def coerce(value):
+        try:
+            return canonical[' '.join(value.split()).lower()]
+        except KeyError:
+            raise ValueError(message) from None
+
+    return coerce
+
+
+# uploads repeat the same few thousand dates, so each is parsed once
+@lru_cache(maxsize=4096)
+def date_text(value):
+    value = ' '.join(value.split())
+    if not date_ordinal(value):
+        raise ValueError('is not a date like "Feb 24, 2009"')
+    return value
+
+
+CASE_SCHEMA = (
+    Column('case_id', 'Case_ID', whole_number, required=True, unique=True),
+    Column('case_type', 'Case_Type', fold=True),
+    Column('region', 'Region', fold=True),
+    Column('priority', 'Priority', one_of('High', 'Medium', 'Low')),
+    Column('points', 'Points', whole_number, required=True),
+    Column('date_filled', 'Date_Filled', date_text),
+    Column('description', 'Description'),
+)
+
+
+class RowErrors:
+    """
+    Problems found in an upload. Every error is counted, but only the
+    first `limit` are kept, since a wrong file can have one per row.
+    """
+
+    def __init__(self, limit=MAX_REPORTED_ERRORS):
+        self.limit = limit
+        self.items = []
+        self.count = 0
+
+    def add(self, line, column, value, problem):
+        self.count += 1
+        if len(self.items) < self.limit:
+            self.items.append({'line': line, 'column': column, 'value': value, 'error': problem})
+
+    def __bool__(self):
+        return self.count > 0
+
+    def __len__(self):
+        return self.count
+
+    def describe(self, n=10):
+        """e.g. 'Line 5, Points: "abc" is not a whole number; ... (and 3 more)'"""
+        parts = []
+        for e in self.items[:n]:
+            where = f"Line {e['line']}" + (f", {e['column']}" if e['column'] else '')
+            value = f'"{e["value"]}" ' if e['value'] is not None else ''
+            parts.append(f"{where}: {value}{e['error']}")
+        if self.count > n:
+            parts.append(f'(and {self.count - n} more)')
+        return '; '.join(parts)
+
+
+def iter_cases(lines, errors, schema=CASE_SCHEMA, spellings=None):
+    """
+    Checks and converts the CSV in a single pass, yielding one dict of Case
+    fields per valid row. Every problem is recorded in errors (a RowErrors)
+    and the row it's in is skipped; if a required column is missing,
+    nothing is yielded at all.
+
+    spellings is {field: {folded value: spelling}} for the fold columns,
+    e.g. the spellings already in the database, and is added to as new
+    values are seen.
+    """
+    if spellings is None:
+        spellings = {}
+    reader = csv.reader(lines)
+    header = [name.strip() for name in next(reader, [])]
+    positions = {name: i for i, name in enumerate(header)}
+
+    # unpacked once, since this loop runs for every cell of the file
+    columns = []
+    # optional columns the file doesn't have
+    missing = {}
+    for column in schema:
+        if column.header in positions:
+            seen = set() if column.unique else None
+            spelling = spellings.setdefault(column.field, {}) if column.fold else None
+            columns.append((
+                column.field, positions[column.header], column.header, column.coerce,
+                column.required, column.default, seen, spelling,
+            ))
+        elif column.required:
+            errors.add(1, column.header, None, 'column is missing')
+        else:
+            missing[column.field] = column.default
+    if errors or not columns:
+        return
+
+    width = max(i for _, i, *_ in columns) + 1
+    for row in reader:
+        if not row:
+            continue
+        if len(row) < width:
+            row += [''] * (width - len(row))
+        case = dict(missing)
+        valid = True
+        for field, i, header, coerce, required, default, seen, spelling in columns:
+            value = row[i].strip()
+            if not value:
+                if required:
+                    errors.add(reader.line_num, header, None, 'is empty')
+                    valid = False
+                else:
+                    case[field] = default
+                continue
+            if coerce is not None:
+                try:
+                    value = coerce(value)
+                except ValueError as exc:
+                    errors.add(reader.line_num, header, row[i], str(exc))
+                    valid = False
+                    continue
+            if spelling is not None:
+                value = ' '.join(value.split())
+                value = spelling.setdefault(value.lower(), value)
+            if seen is not None:
+                if value in seen:
+                    errors.add(reader.line_num, header, row[i], 'appears more than once')
+                    valid = False
+                    continue
+                seen.add(value)
+            case[field] = value
+        if valid:
+            yield case
+
+
+def validate_cases(lines, schema=CASE_SCHEMA):
+    """
+    Checks the whole CSV without importing it.
+    Returns (number of valid rows, RowErrors).
+    """
+    errors = RowErrors()
+    rows = 0
+    for _ in iter_cases(lines, errors, schema):
+        rows += 1
+    return rows, errors
+
+
+# text field -> integer column holding its interned code
+INTERNED_FIELDS = {
+    'region': 'region_code',
+    'case_type': 'case_type_code',
+}
+
+_date_ordinal = lru_cache(maxsize=4096)(date_ordinal)
+
+
+def load_vocabulary(Case, subsession):
+    """{field: {value: code}} of the codes already used in subsession"""
+    return {
+        field: dict(Case.objects_filter(subsession=subsession).with_entities(
+            getattr(Case, field), getattr(Case, code)
+        ).distinct())
+        for field, code in INTERNED_FIELDS.items()
+    }
+
+
+def load_spellings(vocabulary):
+    """
+    {field: {folded value: spelling}} for iter_cases, from load_vocabulary,
+    so values already in the subsession keep their spelling. If it holds
+    several spellings of one value, the one with the lowest code is kept.
+    """
+    spellings = {}
+    for field, codes in vocabulary.items():
+        folded = spellings[field] = {}
+        for value, _ in sorted(codes.items(), key=lambda item: item[1]):
+            folded.setdefault(' '.join(value.split()).lower(), value)
+    return spellings
+
+
+def add_derived_columns(case, vocabulary):
+    """
+    Sets the integer columns sorting and filtering use (see
+    common.case_index.DERIVED_FIELDS). Region and case type values get the
+    next free code in the subsession the first time they're seen.
+    """
+    case['date_ordinal'] = _date_ordinal(case['date_filled'])
+    case['priority_rank'] = priority_rank(case['priority'])
+    for field, column in INTERNED_FIELDS.items():
+        codes = vocabulary[field]
+        value = case[field]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = max(codes.values(), default=0) + 1
+        case[column] = code
+
+
+def content_hash(case, schema=CASE_SCHEMA):
+    """Short hash of a row's values, to tell whether a re-uploaded case changed"""
+    values = '\x1f'.join(str(case[column.field]) for column in schema)
+    return hashlib.blake2b(values.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def ingest_cases(Case, subsession, lines, chunk_size=CHUNK_SIZE):
+    """
+    Makes subsession's cases match the CSV, keyed by Case_ID: new cases
+    are inserted, cases whose content hash differs (or that had been
+    retired) are updated in place, and cases missing from the file are
+    retired (kept, since bids and assignments may point at them, but
+    flagged so nothing offers them any more). Unchanged rows aren't
+    written, so uploading the same file again changes nothing.
+
+    Progress is logged after every chunk. Invalid rows are skipped and
+    counted (callers normally reject such files with validate_cases first).
+
+    Returns (summary, upserted case_ids, retired case_ids). summary is
+    {'rows', 'inserted', 'updated', 'unchanged', 'retired', 'rejected',
+    'seconds', 'rows_per_second'}, which the apps keep in
+    session.vars['ingest'] for the AdminReview page.
+    """
+    start = time.perf_counter()
+    # oTree's SQLAlchemy session, which holds the request's transaction
+    session = Case.objects_filter().session
+    table = Case.__table__
+    insert = table.insert()
+    update = table.update().where(table.c.id == bindparam('_id'))
+    # flush pending ORM changes first, so they're written before the
+    # rows changed underneath the ORM
+    session.flush()
+
+    # case_id -> (primary key, content hash, retired)
+    existing = {
+        case_id: (pk, digest, retired)
+        for case_id, pk, digest, retired in Case.objects_filter(subsession=subsession).with_entities(
+            Case.case_id, Case.id, Case.content_hash, Case.retired
+        )
+    }
+
+    vocabulary = load_vocabulary(Case, subsession)
+
+    counts = dict.fromkeys(['rows', 'inserted', 'updated', 'unchanged', 'retired'], 0)
+    upserted = []
+    inserts = []
+    updates = []
+    errors = RowErrors()
+    for case in iter_cases(lines, errors, spellings=load_spellings(vocabulary)):
+        counts['rows'] += 1
+        case_id = case['case_id']
+        case['content_hash'] = digest = content_hash(case)
+        previous = existing.pop(case_id, None)
+        if previous is not None and previous[1] == digest and not previous[2]:
+            counts['unchanged'] += 1
+            continue
+        add_derived_columns(case, vocabulary)
+        if previous is None:
+            case['subsession_id'] = subsession.id
+            inserts.append(case)
+        else:
+            case['_id'] = previous[0]
+            case['retired'] = False
+            updates.append(case)
+        upserted.append(case_id)
+
+        for pending, statement, kind in ((inserts, insert, 'inserted'), (updates, update, 'updated')):
+            if len(pending) >= chunk_size:
+                session.execute(statement, pending)
+                counts[kind] += len(pending)
+                pending.clear()
+                logger.info('Subsession %s: %d cases read', subsession.id, counts['rows'])
+    if inserts:
+        session.execute(insert, inserts)
+        counts['inserted'] += len(inserts)
+    if updates:
+        session.execute(update, updates)
+        counts['updated'] += len(updates)
+
+    # whatever is left wasn't in the file
+    retired = [case_id for case_id, (_, _, was_retired) in existing.items() if not was_retired]
+    pks = [existing[case_id][0] for case_id in retired]
+    for i in range(0, len(pks), RETIRE_BATCH_SIZE):
+        session.execute(
+            table.update().where(table.c.id.in_(pks[i:i + RETIRE_BATCH_SIZE])).values(retired=True)
+        )
+    counts['retired'] = len(retired)
+
+    seconds = time.perf_counter() - start
+    logger.info(
+        'Subsession %s: %d cases read in %.2fs: %d inserted, %d updated, %d unchanged, %d retired',
+        subsession.id, counts['rows'], seconds,
+        counts['inserted'], counts['updated'], counts['unchanged'], counts['retired'],
+    )
+    summary = dict(
+        counts,
+        rejected=len(errors),
+        seconds=round(seconds, 3),
+        rows_per_second=round(counts['rows'] / seconds) if seconds else counts['rows'],
+    )
+    return summary, upserted, retired
@@ -0,0 +1,45 @@
+"""
+Judge registration, shared by both apps.
+
+Each judge's Judge row is looked up (or created) once, at login, and its
+primary key and judge_id are cached in participant.vars, so live methods
+and page hooks can resolve the judge without querying.
+"""
+
+
+def _vars_key(player):
+    # one entry per app, since each app has its own Judge table
+    return f'{type(player).__module__}_judge'
+
+
+def register_judge(player, Judge):
+    """
+    Creates the player's Judge row if it doesn't exist yet and caches it
+    on the participant. Safe to call any number of times.
+    """
+    key = _vars_key(player)
+    if key in player.participant.vars:
+        return player.participant.vars[key]
+
+    judges = Judge.filter(subsession=player.subsession, player=player)
+    if not judges:
+        Judge.create(
+            subsession=player.subsession,
+            player=player,
+            judge_id=player.id_in_group,
+        )
+        # querying again flushes the new row, so it has a primary key
+        judges = Judge.filter(subsession=player.subsession, player=player)
+
+    judge = player.participant.vars[key] = {
+        'pk': judges[0].id,
+        'judge_id': judges[0].judge_id,
+    }
+    return judge
+
+
+def cached_judge(player):
+    """
+    {'pk': ..., 'judge_id': ...} for a registered judge, or None.
+    """
+    return player.participant.vars.get(_vars_key(player))
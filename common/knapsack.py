@@ -0,0 +1,102 @@
+"""
+Suggested selections for the greedy game: given the cases still available
+and a judge's remaining budget, pick a subset that fits.
+
+Two objectives are supported:
+
+* 'points': use as much of the budget as possible (0/1 knapsack where a
+  case's value is its points, i.e. subset sum). Solved exactly with a
+  bitset DP, where Python ints serve as the bitsets, as long as
+  cases x budget stays under DP_CELL_LIMIT; above that a first-fit
+  decreasing approximation is used.
+* 'count': take as many cases as possible. Taking the cheapest cases first
+  is optimal for this, so no DP is needed.
+"""
+from collections import OrderedDict
+
+
+# Largest cases x budget solved exactly. The DP keeps one bitset per case
+# for reconstruction, so this also bounds its memory (~DP_CELL_LIMIT / 8 bytes).
+DP_CELL_LIMIT = 50_000_000
+
+SUGGESTION_CACHE_SIZE = 256
+
+OBJECTIVES = ('points', 'count')
+
+
+def suggest(items, budget, objective='points'):
+    """
+    items: iterable of (case_id, points).
+    Returns (case_ids, total_points, exact) where exact says whether the
+    result is guaranteed optimal. Nothing fits a negative budget.
+    """
+    if budget < 0:
+        return [], 0, True
+    items = [(cid, points) for cid, points in items if 0 <= points <= budget]
+    if objective == 'count':
+        return _cheapest_first(items, budget)
+    if len(items) * budget > DP_CELL_LIMIT:
+        return _first_fit_decreasing(items, budget)
+    return _subset_sum(items, budget)
+
+
+def _cheapest_first(items, budget):
+    chosen = []
+    total = 0
+    for cid, points in sorted(items, key=lambda item: (item[1], item[0])):
+        if total + points > budget:
+            break
+        chosen.append(cid)
+        total += points
+    return chosen, total, True
+
+
+def _first_fit_decreasing(items, budget):
+    chosen = []
+    total = 0
+    for cid, points in sorted(items, key=lambda item: (-item[1], item[0])):
+        if total + points <= budget:
+            chosen.append(cid)
+            total += points
+    return chosen, total, False
+
+
+def _subset_sum(items, budget):
+    # bit s of reach[i] is set if a subset of items[:i] sums to exactly s
+    mask = (1 << (budget + 1)) - 1
+    reach = [1]
+    for _, points in items:
+        prev = reach[-1]
+        reach.append((prev | (prev << points)) & mask)
+
+    total = reach[-1].bit_length() - 1
+    chosen = []
+    s = total
+    for i in range(len(items) - 1, -1, -1):
+        if not (reach[i] >> s) & 1:
+            # s wasn't reachable without item i, so item i is in the subset
+            cid, points = items[i]
+            chosen.append(cid)
+            s -= points
+    chosen.reverse()
+    return chosen, total, True
+
+
+class SuggestionCache:
+    """
+    LRU of suggestions. Callers key it by whatever determines the set of
+    available cases (e.g. pool and claim versions) plus budget and objective.
+    """
+
+    def __init__(self, maxsize=SUGGESTION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+
+    def get(self, key, compute):
+        if key in self.items:
+            self.items.move_to_end(key)
+            return self.items[key]
+        result = self.items[key] = compute()
+        if len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+        return result
@@ -0,0 +1,215 @@
+"""
+Latency instrumentation for live methods and page hooks.
+
+Wrap a live method with instrument_live() and decorate page hooks
+(vars_for_template, before_next_page, after_all_players_arrive, ...) with
+@timed. Each call is recorded, under a name like 'greedy.live_method:load'
+or 'greedy.SelectCases.before_next_page', in an in-process histogram of
+its latency and, for live methods, a sampled histogram of message sizes.
+
+oTree runs these hooks one at a time in its event loop, so the histograms
+are plain counters updated without locks. They are written to
+METRICS_FILE at most every DUMP_INTERVAL seconds, and each app shows them
+on its admin report (the Reports tab of the session admin).
+"""
+from functools import wraps
+import json
+import logging
+import os
+import time
+
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get('OTREE_METRICS', '1') != '0'
+METRICS_FILE = os.environ.get('OTREE_METRICS_FILE', 'live_metrics.json')
+DUMP_INTERVAL = 60
+
+# Measuring a reply means serializing it a second time, so only every Nth
+# message per series is sized; latency is recorded for every call.
+PAYLOAD_SAMPLE_EVERY = 32
+
+# Cap on distinct series, so clients sending made-up actions can't grow
+# the registry without bound; anything past it is recorded as '<name>:other'.
+MAX_SERIES = 200
+
+# Values below 2 ** SUB_BITS get their own bucket; above that, each power
+# of two is split into 2 ** (SUB_BITS - 1) buckets (~12% wide).
+SUB_BITS = 4
+
+
+def bucket_of(value):
+    if value < (1 << SUB_BITS):
+        return value
+    shift = value.bit_length() - SUB_BITS
+    return (shift << (SUB_BITS - 1)) + (value >> shift)
+
+
+def bucket_upper_bound(bucket):
+    """Smallest value that falls in the next bucket"""
+    if bucket < (1 << SUB_BITS):
+        return bucket + 1
+    half = 1 << (SUB_BITS - 1)
+    shift = bucket // half - 1
+    return (bucket % half + half + 1) << shift
+
+
+class Histogram:
+    """Log-linear histogram of non-negative integers (microseconds, bytes)"""
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        bucket = bucket_of(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th percentile (0-100)"""
+        if not self.count:
+            return 0
+        rank = q / 100 * self.count
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(bucket_upper_bound(bucket), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+
+class Series:
+    __slots__ = ('latency_us', 'payload_bytes', 'calls')
+
+    def __init__(self):
+        self.latency_us = Histogram()
+        self.payload_bytes = Histogram()
+        self.calls = 0
+
+
+_series = {}
+_last_dump = time.monotonic()
+
+
+def record(name, seconds, payload=None):
+    """
+    Records one call. payload, if given, is a callable returning the
+    message size in bytes; it is only called for sampled messages.
+    """
+    series = _series.get(name)
+    if series is None:
+        if len(_series) >= MAX_SERIES:
+            name = name.split(':', 1)[0] + ':other'
+        series = _series.setdefault(name, Series())
+    series.calls += 1
+    series.latency_us.record(int(seconds * 1_000_000))
+    if payload is not None and series.calls % PAYLOAD_SAMPLE_EVERY == 1:
+        series.payload_bytes.record(payload())
+    maybe_dump()
+
+
+def _payload_size(data, response):
+    size = len(json.dumps(data, default=str))
+    if response:
+        size += len(json.dumps(response, default=str))
+    return size
+
+
+def instrument_live(live_method):
+    """
+    Wraps a live method, recording each message under
+    '<module>.<function>:<action>'.
+    """
+    if not ENABLED:
+        return live_method
+    prefix = f'{live_method.__module__}.{live_method.__qualname__}'
+
+    @wraps(live_method)
+    def wrapper(player, data):
+        start = time.perf_counter()
+        response = None
+        try:
+            response = live_method(player, data)
+            return response
+        finally:
+            elapsed = time.perf_counter() - start
+            action = data.get('action') if isinstance(data, dict) else None
+            record(
+                f'{prefix}:{action if isinstance(action, str) else "other"}',
+                elapsed,
+                payload=lambda: _payload_size(data, response),
+            )
+
+    return wrapper
+
+
+def timed(func):
+    """Decorator recording a page hook's latency under '<module>.<qualname>'"""
+    if not ENABLED:
+        return func
+    name = f'{func.__module__}.{func.__qualname__}'
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            record(name, time.perf_counter() - start)
+
+    return wrapper
+
+
+def summary():
+    """One dict per series, sorted by name, with latencies in milliseconds"""
+    rows = []
+    for name in sorted(_series):
+        series = _series[name]
+        latency = series.latency_us
+        payload = series.payload_bytes
+        rows.append({
+            'name': name,
+            'count': latency.count,
+            'mean_ms': round(latency.mean() / 1000, 3),
+            'p50_ms': latency.percentile(50) / 1000,
+            'p95_ms': latency.percentile(95) / 1000,
+            'p99_ms': latency.percentile(99) / 1000,
+            'max_ms': latency.max / 1000,
+            'payload_samples': payload.count,
+            'payload_p50_bytes': payload.percentile(50),
+            'payload_p95_bytes': payload.percentile(95),
+            'payload_max_bytes': payload.max,
+        })
+    return rows
+
+
+def maybe_dump(now=None):
+    """Writes the summary to METRICS_FILE if DUMP_INTERVAL has passed"""
+    global _last_dump
+    now = time.monotonic() if now is None else now
+    if now - _last_dump < DUMP_INTERVAL:
+        return
+    _last_dump = now
+    dump()
+
+
+def dump(path=None):
+    path = path or METRICS_FILE
+    content = {'pid': os.getpid(), 'time': time.time(), 'metrics': summary()}
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump(content, f, indent=1)
+        os.replace(tmp_path, path)
+    except OSError:
+        logger.exception('Could not write live metrics to %s', path)
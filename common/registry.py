@@ -0,0 +1,40 @@
+"""
+Per-process state kept for each subsession (case indexes, claim tables,
+event batchers), keyed by subsession id.
+
+A server hosts many sessions over its lifetime but only a few are being
+played at any one time, so a registry keeps the state of the
+MAX_SUBSESSIONS most recently used subsessions and drops the rest. All of
+it can be rebuilt from the database, which `create` does the next time an
+evicted subsession is used.
+"""
+from collections import OrderedDict
+
+
+MAX_SUBSESSIONS = 8
+
+
+class SubsessionRegistry:
+    def __init__(self, create, maxsize=MAX_SUBSESSIONS):
+        self.create = create
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+
+    def get(self, subsession):
+        """The subsession's state, created with create(subsession) if missing"""
+        key = subsession.id
+        if key in self.items:
+            self.items.move_to_end(key)
+            return self.items[key]
+        value = self.create(subsession)
+        self.items[key] = value
+        while len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+        return value
+
+    def peek(self, subsession):
+        """The subsession's state if there is any, without creating it"""
+        return self.items.get(subsession.id)
+
+    def discard(self, subsession):
+        self.items.pop(subsession.id, None)
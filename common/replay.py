@@ -0,0 +1,141 @@
+"""
+Replays the batch auction's clearing from the database, without the web
+server, and checks it against the stored assignments:
+
+    python -m common.replay SESSION_CODE [SESSION_CODE ...]
+
+Each round is cleared again from its stored CaseBid rows with the
+session's clearing seed (see common.clearing), and the allocation is
+written as CSV (to stdout, or --output). The database is DATABASE_URL, as
+for oTree itself, or db.sqlite3; use --database to read another one. The
+exit status is 1 if any case's replayed winner differs from the stored
+one.
+"""
+import argparse
+import binascii
+import csv
+import os
+import pickle
+import sys
+import time
+
+import sqlalchemy as sa
+
+from .clearing import NO_WINNER, clear_case_bids, clearing_rng
+
+
+HEADER = ['session', 'round', 'case_id', 'judge_id', 'price', 'ties', 'stored_judge_id', 'matches']
+
+
+def load_session_vars(engine, code):
+    """(id, vars) of the session with the given code"""
+    sessions = sa.Table('otree_session', sa.MetaData(), autoload_with=engine)
+    row = engine.execute(
+        sa.select([sessions.c.id, sessions.c._vars]).where(sessions.c.code == code)
+    ).first()
+    if row is None:
+        raise LookupError(f'No session with code {code!r}')
+    # stored the way oTree stores it: a base64-encoded pickle of a dict
+    return row.id, pickle.loads(binascii.a2b_base64(row._vars.encode('utf-8')))
+
+
+def replay_session(engine, code, app='batch'):
+    """
+    Yields one row (see HEADER) per case on offer in each round of the
+    session, in round and case order.
+    """
+    session_id, session_vars = load_session_vars(engine, code)
+    seed = session_vars.get('clearing_seed')
+    if seed is None:
+        raise LookupError(f'Session {code!r} has no clearing seed')
+
+    metadata = sa.MetaData()
+    subsessions, cases, bids, judges = (
+        sa.Table(f'{app}_{name}', metadata, autoload_with=engine)
+        for name in ('subsession', 'case', 'casebid', 'judge')
+    )
+    rounds = engine.execute(
+        sa.select([subsessions.c.id, subsessions.c.round_number])
+        .where(subsessions.c.session_id == session_id)
+        .order_by(subsessions.c.round_number)
+    )
+    for subsession_id, round_number in rounds.fetchall():
+        # case primary key -> (case_id, stored Judge primary key)
+        offered = {
+            row.id: (row.case_id, row.assigned_judge_id if row.is_assigned else None)
+            for row in engine.execute(
+                sa.select([cases.c.id, cases.c.case_id, cases.c.is_assigned, cases.c.assigned_judge_id])
+                .where(sa.and_(cases.c.subsession_id == subsession_id, cases.c.retired == sa.false()))
+            )
+        }
+        # Judge primary key and judge_id, by player id
+        judge_rows = engine.execute(
+            sa.select([judges.c.player_id, judges.c.id, judges.c.judge_id])
+            .where(judges.c.subsession_id == subsession_id)
+        ).fetchall()
+        judge_pks = {row.player_id: row.id for row in judge_rows}
+        judge_ids = {row.id: row.judge_id for row in judge_rows}
+        # in the order they were made, as in set_assignments
+        case_bids = engine.execute(
+            sa.select([bids.c.case_id, bids.c.player_id, bids.c.bid_amount])
+            .where(sa.and_(bids.c.subsession_id == subsession_id, bids.c.bid_amount.isnot(None)))
+            .order_by(bids.c.id)
+        ).fetchall()
+
+        case_pks, winners, prices, ties = clear_case_bids(
+            case_bids, offered, clearing_rng(seed, round_number)
+        )
+        rows = []
+        for case_pk, winner, price, tie_count in zip(case_pks.tolist(), winners.tolist(), prices.tolist(), ties.tolist()):
+            case_id, stored_pk = offered[case_pk]
+            judge_pk = judge_pks.get(winner) if winner != NO_WINNER else None
+            rows.append([
+                code, round_number, case_id,
+                judge_ids.get(judge_pk, ''),
+                price if tie_count else '',
+                tie_count,
+                judge_ids.get(stored_pk, ''),
+                judge_pk == stored_pk,
+            ])
+        rows.sort(key=lambda row: row[2])
+        yield from rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m common.replay', description=__doc__.split('\n\n')[0])
+    parser.add_argument('session_codes', nargs='+', metavar='SESSION_CODE')
+    parser.add_argument(
+        '--database',
+        default=os.environ.get('DATABASE_URL', 'sqlite:///db.sqlite3'),
+        help='SQLAlchemy database URL (default: DATABASE_URL or db.sqlite3)',
+    )
+    parser.add_argument('--app', default='batch', help='name of the auction app (default: batch)')
+    parser.add_argument('--output', help='CSV file to write (default: stdout)')
+    args = parser.parse_args(argv)
+
+    engine = sa.create_engine(args.database)
+    out = open(args.output, 'w', newline='') if args.output else sys.stdout
+    writer = csv.writer(out)
+    writer.writerow(HEADER)
+    cases = mismatches = 0
+    start = time.perf_counter()
+    try:
+        for code in args.session_codes:
+            for row in replay_session(engine, code, args.app):
+                writer.writerow(row)
+                cases += 1
+                mismatches += not row[-1]
+    except LookupError as exc:
+        parser.error(str(exc))
+    finally:
+        if args.output:
+            out.close()
+    print(
+        f'{cases} cases replayed in {time.perf_counter() - start:.2f}s, {mismatches} not matching',
+        file=sys.stderr,
+    )
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,342 @@
+"""
+A judge's selection of cases: its stored form, and validation against the
+case index and their budget.
+
+Validation is used on submit, by the select_case/select_many live actions
+and by anything else that sets a selection in bulk, so they all agree on
+what is allowed.
+"""
+from bisect import bisect_left
+from collections import OrderedDict
+import json
+
+
+# Decoded selections are cached up to this many case_ids in total (a
+# decoded id costs ~40 bytes, in the sorted list and the stored string, so
+# ~4 MB). The cap is on ids rather than entries, since one selection can
+# hold 10k of them.
+DECODE_CACHE_IDS = 100_000
+
+# Most case_ids a selection can hold. decode() refuses anything larger, so
+# a short value like '1-999999999' can't expand into a huge list.
+MAX_SELECTION_IDS = 200_000
+
+# add() and remove() with up to this many ids patch the encoded string
+# (one case at a time) instead of encoding the new selection from scratch
+PATCH_LIMIT = 16
+
+
+class CaseSelection:
+    """
+    Immutable set of case_ids, kept as a sorted list; membership is a
+    binary search. add() and remove() return a new selection.
+
+    Stored as ranges of consecutive ids, e.g. '3-7,12,20-21', which stays
+    short for runs of cases and readable in data exports. decode() also
+    accepts the JSON lists ('[3, 4, 12]') that selections used to be
+    stored as.
+
+    The encoded string is kept with the selection once known. A select or
+    unselect click changes one case, so add() and remove() patch the run
+    that case is in rather than re-encoding thousands of ids; the string
+    is copied, but not rebuilt in Python.
+    """
+    __slots__ = ('ids', '_encoded', '_members')
+
+    def __init__(self, case_ids=()):
+        self.ids = sorted({int(cid) for cid in case_ids})
+        self._encoded = None
+        self._members = None
+
+    @classmethod
+    def _from_sorted(cls, ids, encoded=None):
+        selection = cls.__new__(cls)
+        selection.ids = ids
+        selection._encoded = encoded
+        selection._members = None
+        return selection
+
+    def __contains__(self, case_id):
+        ids = self.ids
+        try:
+            i = bisect_left(ids, case_id)
+        except TypeError:
+            return False
+        return i < len(ids) and ids[i] == case_id
+
+    @property
+    def members(self):
+        """frozenset of the case_ids, for set operations"""
+        if self._members is None:
+            self._members = frozenset(self.ids)
+        return self._members
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __eq__(self, other):
+        return isinstance(other, CaseSelection) and self.ids == other.ids
+
+    def __repr__(self):
+        return f"CaseSelection('{self.encode()}')"
+
+    def add(self, case_ids):
+        new = sorted({int(cid) for cid in case_ids if cid not in self})
+        if not new:
+            return self
+        if len(new) > PATCH_LIMIT:
+            return CaseSelection._from_sorted(sorted(self.ids + new))
+        ids = list(self.ids)
+        encoded = self._encoded
+        for case_id in new:
+            i = bisect_left(ids, case_id)
+            if encoded is not None:
+                encoded = _patch_add(ids, i, case_id, encoded)
+            ids.insert(i, case_id)
+        return CaseSelection._from_sorted(ids, encoded)
+
+    def remove(self, case_ids):
+        gone = sorted({cid for cid in case_ids if cid in self})
+        if not gone:
+            return self
+        if len(gone) > PATCH_LIMIT:
+            gone = set(gone)
+            return CaseSelection._from_sorted([cid for cid in self.ids if cid not in gone])
+        ids = list(self.ids)
+        encoded = self._encoded
+        for case_id in gone:
+            i = bisect_left(ids, case_id)
+            if encoded is not None:
+                encoded = _patch_remove(ids, i, encoded)
+            del ids[i]
+        return CaseSelection._from_sorted(ids, encoded)
+
+    def to_list(self):
+        return list(self.ids)
+
+    def encode(self):
+        if self._encoded is None:
+            ids = self.ids
+            # positions where a run of consecutive ids starts
+            starts = [i for i in range(1, len(ids)) if ids[i] != ids[i - 1] + 1]
+            ends = starts + [len(ids)]
+            self._encoded = ','.join([
+                _token(ids[start], ids[end - 1]) for start, end in zip([0] + starts, ends)
+            ]) if ids else ''
+        return self._encoded
+
+    @staticmethod
+    def decode(value):
+        """
+        Parses a stored selection. Raises ValueError if it is malformed or
+        holds more than MAX_SELECTION_IDS case_ids. Only for values written
+        by encode(); form input goes through JSON instead.
+        Decoded selections are cached, since they are immutable and players'
+        selections are read far more often than they change.
+        """
+        value = value or ''
+        selection = _decoded.get(value)
+        if selection is not None:
+            _decoded.move_to_end(value)
+            return selection
+        selection = _decode(value)
+        remember(value, selection)
+        return selection
+
+
+# encoded value -> CaseSelection, least recently used first
+_decoded = OrderedDict()
+_decoded_ids = 0
+
+
+def remember(value, selection):
+    """
+    Caches selection as the decoded form of value. Called with every
+    newly encoded selection too, so reading back a selection just stored
+    (e.g. by player.selection) doesn't parse it.
+    """
+    global _decoded_ids
+    if len(selection) > DECODE_CACHE_IDS or value in _decoded:
+        return
+    _decoded[value] = selection
+    _decoded_ids += len(selection)
+    while _decoded_ids > DECODE_CACHE_IDS:
+        _, evicted = _decoded.popitem(last=False)
+        _decoded_ids -= len(evicted)
+
+
+def _decode(value):
+    value = value.strip()
+    if value.startswith('['):
+        case_ids = json.loads(value)
+        if not isinstance(case_ids, list):
+            raise ValueError(f'Not a list of case IDs: {value[:50]!r}')
+        if len(case_ids) > MAX_SELECTION_IDS:
+            raise ValueError(f'More than {MAX_SELECTION_IDS} case IDs')
+        try:
+            return CaseSelection(case_ids)
+        except TypeError:
+            raise ValueError(f'Not a list of case IDs: {value[:50]!r}') from None
+
+    if not value:
+        return CaseSelection._from_sorted([], '')
+    case_ids = []
+    # whether value is exactly what encode() would write, in which case
+    # the ids come out sorted and the string can be kept
+    canonical = True
+    last = None
+    for part in value.split(','):
+        if not part:
+            canonical = False
+            continue
+        if '-' in part:
+            start, _, end = part.partition('-')
+            start, end = int(start), int(end)
+            if not start <= end <= start + MAX_SELECTION_IDS - len(case_ids):
+                raise ValueError(f'Bad or too wide range of case IDs: {part[:50]!r}')
+            if start == end or (last is not None and start <= last + 1):
+                canonical = False
+            case_ids.extend(range(start, end + 1))
+            if len(case_ids) > MAX_SELECTION_IDS:
+                raise ValueError(f'More than {MAX_SELECTION_IDS} case IDs')
+        else:
+            end = int(part)
+            if last is not None and end <= last + 1:
+                canonical = False
+            case_ids.append(end)
+        last = end
+    if len(case_ids) > MAX_SELECTION_IDS:
+        raise ValueError(f'More than {MAX_SELECTION_IDS} case IDs')
+    if canonical:
+        return CaseSelection._from_sorted(case_ids, value)
+    return CaseSelection(case_ids)
+
+
+# In a sorted list of distinct ids, ids[k] - k is the same all through a
+# run of consecutive ids and larger after it, so a run's ends can be
+# found by binary search.
+
+def _run_start(ids, i):
+    key = ids[i] - i
+    lo, hi = 0, i
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if ids[mid] - mid < key:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def _run_end(ids, i):
+    key = ids[i] - i
+    lo, hi = i, len(ids) - 1
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if ids[mid] - mid > key:
+            hi = mid - 1
+        else:
+            lo = mid
+    return lo
+
+
+def _token(start, end):
+    return str(start) if start == end else f'{start}-{end}'
+
+
+def _replace_token(encoded, old, new):
+    """Replaces the comma-separated item old of encoded by new ('' drops it)"""
+    padded = f',{encoded},'
+    pos = padded.find(f',{old},')
+    if new:
+        padded = f'{padded[:pos + 1]}{new}{padded[pos + 1 + len(old):]}'
+    else:
+        padded = padded[:pos] + padded[pos + 1 + len(old):]
+    return padded[1:-1]
+
+
+def _patch_add(ids, i, case_id, encoded):
+    """encoded with case_id added; ids doesn't have it yet, i is where it goes"""
+    joins_left = i > 0 and ids[i - 1] == case_id - 1
+    joins_right = i < len(ids) and ids[i] == case_id + 1
+    if joins_left:
+        left = _token(ids[_run_start(ids, i - 1)], case_id - 1)
+    if joins_right:
+        right = _token(case_id + 1, ids[_run_end(ids, i)])
+    if joins_left and joins_right:
+        return _replace_token(
+            encoded, f'{left},{right}', _token(ids[_run_start(ids, i - 1)], ids[_run_end(ids, i)])
+        )
+    if joins_left:
+        return _replace_token(encoded, left, _token(ids[_run_start(ids, i - 1)], case_id))
+    if joins_right:
+        return _replace_token(encoded, right, _token(case_id, ids[_run_end(ids, i)]))
+    if i > 0:
+        before = _token(ids[_run_start(ids, i - 1)], ids[i - 1])
+        return _replace_token(encoded, before, f'{before},{case_id}')
+    return f'{case_id},{encoded}' if encoded else str(case_id)
+
+
+def _patch_remove(ids, i, encoded):
+    """encoded with ids[i] removed (ids still has it)"""
+    case_id = ids[i]
+    start, end = ids[_run_start(ids, i)], ids[_run_end(ids, i)]
+    rest = []
+    if start < case_id:
+        rest.append(_token(start, case_id - 1))
+    if case_id < end:
+        rest.append(_token(case_id + 1, end))
+    return _replace_token(encoded, _token(start, end), ','.join(rest))
+
+
+def validate_selection(case_ids, index, budget, is_available, total=0, already=()):
+    """
+    Checks case_ids, in order, in a single pass: each id must be an integer,
+    appear once, exist in the index, be available (is_available(case_id))
+    and fit in what is left of the budget. Cases that don't fit are skipped
+    and later, cheaper ones can still be accepted.
+
+    `total` and `already` describe a selection being added to: its points
+    and the case_ids it contains (these are accepted without being counted
+    again).
+
+    Returns (accepted, total, rejected), where rejected is a list of
+    {'case_id': ..., 'reason': ...} dicts and reason is one of
+    'invalid', 'duplicate', 'not_found', 'unavailable' or 'exceeds_budget'
+    (the latter also has 'excess_amount').
+    """
+    accepted = []
+    rejected = []
+    seen = set()
+    cases = index.cases
+    for raw in case_ids:
+        try:
+            case_id = int(raw)
+        except (TypeError, ValueError):
+            rejected.append({'case_id': raw, 'reason': 'invalid'})
+            continue
+        if case_id in seen:
+            rejected.append({'case_id': case_id, 'reason': 'duplicate'})
+            continue
+        seen.add(case_id)
+        if case_id in already:
+            accepted.append(case_id)
+            continue
+        case = cases.get(case_id)
+        if case is None:
+            rejected.append({'case_id': case_id, 'reason': 'not_found'})
+        elif not is_available(case_id):
+            rejected.append({'case_id': case_id, 'reason': 'unavailable'})
+        elif total + case.points > budget:
+            rejected.append({
+                'case_id': case_id,
+                'reason': 'exceeds_budget',
+                'excess_amount': total + case.points - budget,
+            })
+        else:
+            accepted.append(case_id)
+            total += case.points
+    return accepted, total, rejected
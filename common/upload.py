@@ -0,0 +1,139 @@
+"""
+Streaming upload of the cases CSV, shared by both apps' Admin pages.
+
+The page reads the chosen file a chunk at a time and sends it over the
+live channel in numbered chunks, waiting for each to be acknowledged. Chunks are appended
+to a temporary file and hashed as they arrive, so the server never holds
+the whole file in memory and the CSV never goes through form handling or
+gets stored on the Player. When the last chunk is in, the file is
+validated and the page learns its hash, row count and any problems; it
+then submits just the hash, and the page's before_next_page imports the
+cases from the temporary file and deletes it.
+
+Uploads are kept per process, keyed by the uploading player's id. One
+that sees no activity for UPLOAD_IDLE_SECONDS (the admin closed the page
+or never submitted it) is deleted the next time any upload starts.
+"""
+import hashlib
+import os
+import tempfile
+import time
+
+from .ingest import validate_cases
+
+
+# Largest file accepted, and how much of it the page reads per chunk
+MAX_UPLOAD_BYTES = 200 * 1024 * 1024
+CHUNK_BYTES = 256 * 1024
+
+UPLOAD_IDLE_SECONDS = 60 * 60
+
+
+class Upload:
+    def __init__(self):
+        handle, self.path = tempfile.mkstemp(prefix='cases-', suffix='.csv')
+        self.file = os.fdopen(handle, 'w', encoding='utf-8', newline='')
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.next_seq = 0
+        # set once the last chunk has been received and checked
+        self.digest = None
+        self.rows = 0
+        self.errors = None
+        self.last_active = time.monotonic()
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        self.sha256.update(data)
+        self.size += len(data)
+        self.file.write(text)
+        self.next_seq += 1
+        self.last_active = time.monotonic()
+
+    def finish(self):
+        self.file.close()
+        self.digest = self.sha256.hexdigest()
+        with self.open() as f:
+            self.rows, self.errors = validate_cases(f)
+        self.last_active = time.monotonic()
+
+    def open(self):
+        return open(self.path, encoding='utf-8', newline='')
+
+    def is_valid(self, digest):
+        return self.digest is not None and self.digest == digest and not self.errors
+
+    def discard(self):
+        if not self.file.closed:
+            self.file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+_uploads = {}
+
+
+def get_upload(player):
+    return _uploads.get(player.id)
+
+
+def discard_upload(player):
+    upload = _uploads.pop(player.id, None)
+    if upload:
+        upload.discard()
+
+
+def discard_idle_uploads():
+    cutoff = time.monotonic() - UPLOAD_IDLE_SECONDS
+    for player_id, upload in list(_uploads.items()):
+        if upload.last_active < cutoff:
+            del _uploads[player_id]
+            upload.discard()
+
+
+def handle_upload(player, data):
+    """
+    Live method for the Admin page. Actions:
+
+    * upload_start: begins a new upload, discarding the player's earlier
+      one and any abandoned ones
+    * upload_chunk (seq, data): appends chunk number seq
+    * upload_end: validates the file; the reply has its sha256, rows and
+      errors (empty if it can be imported)
+    """
+    action = data.get('action')
+    upload = get_upload(player)
+
+    if action == 'upload_start':
+        discard_upload(player)
+        discard_idle_uploads()
+        _uploads[player.id] = Upload()
+        return {player.id_in_group: {'action': 'upload_ready', 'chunk_bytes': CHUNK_BYTES}}
+
+    if upload is None or upload.digest is not None:
+        return {player.id_in_group: {'action': 'upload_failed', 'error': 'No upload in progress.'}}
+
+    if action == 'upload_chunk':
+        text = data.get('data')
+        if data.get('seq') != upload.next_seq or not isinstance(text, str):
+            error = 'The upload was interrupted.'
+        elif upload.size + len(text) > MAX_UPLOAD_BYTES:
+            error = f'The file is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB.'
+        else:
+            upload.write(text)
+            return {player.id_in_group: {'action': 'upload_ack', 'seq': data['seq']}}
+        discard_upload(player)
+        return {player.id_in_group: {'action': 'upload_failed', 'error': error}}
+
+    if action == 'upload_end':
+        upload.finish()
+        return {
+            player.id_in_group: {
+                'action': 'upload_done',
+                'sha256': upload.digest,
+                'rows': upload.rows,
+                'errors': upload.errors.describe() if upload.errors else '',
+            }
+        }
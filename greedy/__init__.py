@@ -1,8 +1,22 @@
 from otree.api import *
 import random
 import json
-import io
-import csv
+import logging
+
+from common.broadcast import EventBatcher
+from common.claims import ClaimTable
+from common.ingest import ingest_cases
+from common.judges import cached_judge, register_judge
+from common.knapsack import OBJECTIVES, SuggestionCache, suggest
+from common.metrics import instrument_live, timed, summary as metrics_summary
+from common.registry import SubsessionRegistry
+from common.upload import discard_upload, get_upload, handle_upload
+from common.selection import MAX_SELECTION_IDS, CaseSelection, remember, validate_selection
+from common.case_index import (
+    CaseIndex, DescriptionCache, CHANGE_LOG_SIZE, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE,
+)
+
+logger = logging.getLogger(__name__)
 
 doc = """
 In this game, players start with 2000 points. They select cases. 
@@ -17,8 +31,16 @@ class C(BaseConstants):
     BID_MIN = cu(0)
     BID_MAX = cu(10)
 
+    # How long a judge's claims survive without the judge doing anything
+    # on the page (selecting, unselecting or browsing cases; the page's
+    # automatic pings don't count). Override with the session config key
+    # 'claim_lease_seconds'.
+    CLAIM_LEASE_SECONDS = 300
+
 class Subsession(BaseSubsession):
-    pass
+    # Bumped whenever the pool of unassigned cases changes, so judges'
+    # pages can sync just the difference (see CaseIndex.changes_since).
+    case_pool_version = models.IntegerField(initial=0)
 
 class Group(BaseGroup):
     pass
@@ -27,36 +49,45 @@ class Player(BasePlayer):
     # The player's total budget of points
     budget = models.IntegerField(initial=2000)
 
-    # Holds which case IDs (from the CSV) the player selected
-    selected_case_ids = models.LongStringField(blank=True, default='[]')
+    # Holds which case IDs (from the CSV) the player selected, encoded by
+    # CaseSelection (e.g. '3-7,12'); older sessions stored a JSON list
+    selected_case_ids = models.LongStringField(blank=True, default='')
+
+    # Running total of points for the cases in selected_case_ids, so the
+    # budget check in live_method doesn't have to re-sum the selection.
+    committed_points = models.IntegerField(initial=0)
+
+    # What the SelectCases page submits: a JSON list of case IDs, in the
+    # order they were selected. Kept apart from selected_case_ids so form
+    # data never overwrites (or gets parsed as) the live selection, and
+    # emptied once before_next_page has checked it.
+    submitted_case_ids = models.LongStringField(blank=True)
 
     @property
-    def selected_cases_list(self):
-        return json.loads(self.selected_case_ids)
+    def selection(self):
+        return CaseSelection.decode(self.selected_case_ids)
+
+    @selection.setter
+    def selection(self, value):
+        if not isinstance(value, CaseSelection):
+            value = CaseSelection(value)
+        encoded = value.encode()
+        # the next read of the field gets this selection back unparsed
+        remember(encoded, value)
+        self.selected_case_ids = encoded
 
-    @selected_cases_list.setter
-    def selected_cases_list(self, value):
-        self.selected_case_ids = json.dumps(value)
+    @property
+    def selected_cases_list(self):
+        return self.selection.to_list()
 
     username = models.StringField(blank=True)
     password = models.StringField(blank=True)
 
-    # For Admin: Store entire CSV text
-    csv_data = models.LongStringField(blank=True)
-
-
-# If you still want the dynamic bidding fields (not strictly needed for a “greedy” approach)
-for i in range(1, 100):
-    setattr(
-        Player,
-        f"bid_case_{i}",
-        models.CurrencyField(
-            blank=True,
-            min=cu(0),
-            max=cu(10),
-            label=f"Bid for Case {i}",
-        ),
-    )
+    # For Admin: the uploaded CSV's SHA-256 and how many cases it had
+    # (the file itself is only kept until it's imported)
+    csv_sha256 = models.StringField(blank=True)
+    csv_rows = models.IntegerField(blank=True)
+
 
 class Judge(ExtraModel):
     subsession = models.Link(Subsession)
@@ -73,6 +104,16 @@ class Case(ExtraModel):
     points = models.IntegerField()
     date_filled = models.StringField()
     description = models.LongStringField()
+    # hash of the CSV row, so a re-upload only rewrites cases that changed;
+    # cases dropped from a re-upload are retired rather than deleted
+    content_hash = models.StringField()
+    retired = models.BooleanField(default=False)
+    # derived at ingest (see common.ingest), so sorting and filtering
+    # compare integers instead of re-parsing strings
+    date_ordinal = models.IntegerField()
+    priority_rank = models.IntegerField()
+    region_code = models.IntegerField()
+    case_type_code = models.IntegerField()
 
     # assignment logic
     is_assigned = models.BooleanField(default=False)
@@ -91,94 +132,483 @@ def creating_session(subsession: Subsession):
     But typically we do it after login in `Login.before_next_page`."""
     for player in subsession.get_players():
         if player.participant.vars.get('role') == 'judge':
-            Judge.create(
-                subsession=subsession,
-                player=player,
-                judge_id=player.id_in_group  
-            )
+            register_judge(player, Judge)
+
+
+def build_case_index(subsession: Subsession) -> CaseIndex:
+    return CaseIndex(
+        Case.filter(subsession=subsession, retired=False),
+        version=subsession.case_pool_version,
+    )
+
+
+# Case indexes are kept per process, for the most recently used
+# subsessions, and rebuilt from the database whenever one is missing
+# (e.g. after a restart).
+_case_indexes = SubsessionRegistry(build_case_index)
+
+
+def get_case_index(subsession: Subsession) -> CaseIndex:
+    return _case_indexes.get(subsession)
+
+
+def invalidate_case_index(subsession: Subsession):
+    _case_indexes.discard(subsession)
+    descriptions.discard_subsession(subsession)
+
+
+def load_descriptions(subsession: Subsession, case_ids):
+    rows = Case.objects_filter(Case.case_id.in_(case_ids), subsession=subsession)
+    return dict(rows.with_entities(Case.case_id, Case.description))
+
+
+descriptions = DescriptionCache(load_descriptions)
+
+# Suggested selections, shared by all judges with the same remaining budget
+suggestions = SuggestionCache()
+
+
+# Claim/release events waiting to be pushed to judges, per subsession
+_event_batchers = SubsessionRegistry(lambda subsession: EventBatcher())
+
+
+def get_event_batcher(subsession: Subsession) -> EventBatcher:
+    return _event_batchers.get(subsession)
+
+
+def build_claim_table(subsession: Subsession) -> ClaimTable:
+    lease_seconds = subsession.session.config.get(
+        'claim_lease_seconds', C.CLAIM_LEASE_SECONDS
+    )
+    table = ClaimTable(lease_seconds)
+    # after a restart, judges keep whatever they had selected
+    index = get_case_index(subsession)
+    for p in subsession.get_players():
+        for cid in p.selection:
+            if cid in index and not index.is_assigned(cid):
+                table.claim(cid, p.id_in_group)
+    return table
+
+
+# Who holds which case right now, per subsession
+_claim_tables = SubsessionRegistry(build_claim_table)
+
+
+def get_claim_table(subsession: Subsession) -> ClaimTable:
+    return _claim_tables.get(subsession)
+
+
+def release_expired_claims(subsession: Subsession, expired, batcher: EventBatcher):
+    """
+    Drops cases whose lease ran out from their judges' selections, with
+    one query for all affected players.
+    """
+    index = get_case_index(subsession)
+    players = Player.objects_filter(Player.id_in_group.in_(expired), subsession=subsession)
+    for p in players:
+        p.selection = p.selection.remove(expired[p.id_in_group])
+        reconcile_ledger(p, index)
+    for holder, case_ids in expired.items():
+        for cid in case_ids:
+            batcher.release(cid, holder)
+
+
+# case_ids per IN (...) query (SQLite allows 999 bound parameters)
+CASE_BATCH_SIZE = 500
+
+
+def apply_case_changes(subsession: Subsession, upserted, retired):
+    """
+    Brings everything kept in memory in line with a (re-)upload: the case
+    index, descriptions, claims, and the selections and ledgers of judges
+    holding cases that changed or were retired.
+
+    Small changes are applied to the index in place and logged, so judges
+    get them with their next 'sync' instead of reloading the pool. Connected
+    judges are told the pool changed, which makes their pages sync.
+    """
+    if not upserted and not retired:
+        return
+    index = _case_indexes.peek(subsession)
+    if index is None or len(upserted) + len(retired) > CHANGE_LOG_SIZE:
+        # nothing to patch, or more than clients could catch up on
+        subsession.case_pool_version += 1
+        invalidate_case_index(subsession)
+        index = get_case_index(subsession)
+    else:
+        rows = []
+        for i in range(0, len(upserted), CASE_BATCH_SIZE):
+            rows.extend(Case.objects_filter(
+                Case.case_id.in_(upserted[i:i + CASE_BATCH_SIZE]), subsession=subsession
+            ))
+        index.apply(rows, retired)
+        descriptions.discard(subsession, upserted)
+        subsession.case_pool_version = index.version
+
+    claims = get_claim_table(subsession)
+    batcher = get_event_batcher(subsession)
+    for cid in retired:
+        holder = claims.holder(cid)
+        if holder is not None:
+            claims.release(cid, holder)
+        batcher.remove(cid)
+    batcher.pool_changed(index.version)
+
+    changed = set(upserted).union(retired)
+    for p in subsession.get_players():
+        selection = p.selection
+        if not selection.members.isdisjoint(changed):
+            p.selection = selection.remove(retired)
+            reconcile_ledger(p, index)
+
+
+def parse_case_ids(value):
+    """
+    A submitted submitted_case_ids value -> list, or [] if it's malformed.
+    The page posts a JSON list (in selection order), and nothing else is
+    accepted; the items are checked by validate_selection.
+    """
+    try:
+        case_ids = json.loads(value or '[]')
+    except ValueError:
+        return []
+    if not isinstance(case_ids, list) or len(case_ids) > MAX_SELECTION_IDS:
+        return []
+    return case_ids
+
+
+def write_assignments(subsession: Subsession, case_ids, judge_pk):
+    """
+    Assigns many cases to the judge with primary key judge_pk (or clears
+    their assignment if judge_pk is None), with one UPDATE per
+    CASE_BATCH_SIZE cases.
+    """
+    case_ids = list(case_ids)
+    for i in range(0, len(case_ids), CASE_BATCH_SIZE):
+        # no Case rows are loaded on this request, so nothing needs syncing
+        Case.objects_filter(
+            Case.case_id.in_(case_ids[i:i + CASE_BATCH_SIZE]), subsession=subsession
+        ).update(
+            {Case.is_assigned: judge_pk is not None, Case.assigned_judge_id: judge_pk},
+            synchronize_session=False,
+        )
+
+
+def selected_points(player: Player, index: CaseIndex):
+    """Sums the points of the player's selection from the case index."""
+    total = 0
+    for cid in player.selection:
+        case = index.get(cid)
+        if case:
+            total += case.points
+    return total
+
+
+def reconcile_ledger(player: Player, index: CaseIndex):
+    """Resets committed_points to the true total of the current selection."""
+    player.committed_points = selected_points(player, index)
+
+
+def ledger_is_consistent(player: Player, index: CaseIndex):
+    """Whether committed_points matches the selection (checked on submit and in tests)"""
+    return player.committed_points == selected_points(player, index)
+
+
+def select_cases(player: Player, case_ids, index: CaseIndex, claims: ClaimTable,
+                 batcher: EventBatcher, all_or_nothing=False):
+    """
+    Adds case_ids to the player's selection in the order given, checking
+    them all against the budget in one pass (see validate_selection).
+    With all_or_nothing, a single rejection means nothing is selected.
+
+    Returns (selected case_ids, rejections).
+    """
+    already = player.selection
+    selected, total, rejected = validate_selection(
+        case_ids,
+        index,
+        player.budget,
+        is_available=lambda cid: not index.is_assigned(cid) and claims.holder(cid) is None,
+        total=player.committed_points,
+        already=already,
+    )
+
+    if all_or_nothing and rejected:
+        return [], rejected
+
+    added = [cid for cid in selected if cid not in already]
+    if added:
+        player.selection = already.add(added)
+        player.committed_points = total
+        for case_id in added:
+            claims.claim(case_id, player.id_in_group)
+            batcher.claim(case_id, player.id_in_group)
+    return selected, rejected
+
+
+def unselect_cases(player: Player, case_ids, index: CaseIndex, claims: ClaimTable,
+                   batcher: EventBatcher):
+    """Removes case_ids from the player's selection; returns those removed."""
+    selection = player.selection
+    to_remove = {cid for cid in case_ids if cid in selection}
+    if not to_remove:
+        return []
+
+    player.selection = selection.remove(to_remove)
+    for case_id in to_remove:
+        case = index.get(case_id)
+        if case:
+            player.committed_points -= case.points
+        if claims.release(case_id, player.id_in_group):
+            batcher.release(case_id, player.id_in_group)
+    return sorted(to_remove)
 
 
+def case_to_dict(case):
+    case_dict = case.as_dict()
+    case_dict['is_assigned'] = False
+    return case_dict
+
+
+def int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# validate_selection() reasons -> the select_case response for them
+REJECTION_ACTIONS = {
+    'not_found': 'case_not_found',
+    'unavailable': 'case_unavailable',
+    'exceeds_budget': 'exceed_budget',
+}
+
+
+# Live actions that only come from something the judge did on the page,
+# and so renew their claim lease
+LEASE_ACTIONS = (
+    'select_case', 'unselect_case', 'select_many', 'unselect_many', 'page', 'query', 'suggest',
+)
+
+
+@instrument_live
 def live_method(player, data):
+    """
+    Handles the message, then piggybacks any pending claim/release events:
+    the sender gets them attached to its reply, and every other connected
+    judge gets them in one 'events' message.
+
+    Actions the judge takes (see LEASE_ACTIONS) renew their claim lease,
+    so an open tab that only pings doesn't hold cases forever. Every
+    message gives the claim table a chance to sweep expired leases.
+    """
+    batcher = get_event_batcher(player.subsession)
+    batcher.connect(player.id_in_group)
+    claims = get_claim_table(player.subsession)
+    if data.get('action') in LEASE_ACTIONS:
+        claims.renew(player.id_in_group)
+    expired = claims.sweep()
+    if expired:
+        release_expired_claims(player.subsession, expired, batcher)
+
+    response = handle_live_action(player, data, batcher, claims)
+
+    events = batcher.flush()
+    if not events:
+        return response
+
+    messages = {
+        pid: {'action': 'events', 'events': events}
+        for pid in batcher.recipients
+    }
+    own = (response or {}).get(player.id_in_group)
+    if own:
+        messages[player.id_in_group] = dict(own, events=events)
+    return messages
+
+
+def handle_live_action(player, data, batcher: EventBatcher, claims: ClaimTable):
     """
     Logistic for Javascript on SelectCase.html that processes various
     actions of what users can do on the page (i.e. selecting a case, 
     unselecting a case, loading the case informaiton, etc).
+    Cases are sent as summaries; descriptions are fetched with 'describe'.
     """
     action = data.get('action')
+    index = get_case_index(player.subsession)
     
+    if action == 'sync':
+        # Only send what changed since the client's last version, if we can
+        delta = index.changes_since(int_or_none(data.get('version')))
+        if delta is not None:
+            updated, removed = delta
+            return {
+                player.id_in_group: {
+                    'action': 'sync',
+                    'version': index.version,
+                    'cases': [case_to_dict(c) for c in updated],
+                    'removed': removed,
+                    'selected_cases': player.selected_cases_list
+                }
+            }
+        if data.get('paged'):
+            # too far behind: a paged client just re-runs its query
+            return {
+                player.id_in_group: {
+                    'action': 'sync',
+                    'version': index.version,
+                    'reset': True,
+                    'selected_cases': player.selected_cases_list
+                }
+            }
+        action = 'load'
+
     if action == 'load':
         # Return all unassigned Cases
-        cases = Case.filter(subsession=player.subsession, is_assigned=False)
-        case_list = []
-        for c in cases:
-            case_list.append({
-                'case_id': c.case_id,
-                'case_type': c.case_type,
-                'region': c.region,
-                'priority': c.priority,
-                'points': c.points,
-                'date_filled': c.date_filled,
-                'description': c.description,
-                'is_assigned': c.is_assigned
-            })
+        case_list = [case_to_dict(c) for c in index.unassigned()]
         selected_cases = player.selected_cases_list
 
         return {
             player.id_in_group: {
                 'action': 'load',
+                'version': index.version,
                 'cases': case_list,
-                'selected_cases': selected_cases
+                'selected_cases': selected_cases,
+                'claims': claims.claims
+            }
+        }
+
+    elif action in ('page', 'query'):
+        # One page of unassigned cases, optionally filtered and sorted
+        cursor = data.get('cursor')
+        page_size = max(1, min(int_or_none(data.get('page_size')) or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+        if action == 'query':
+            cases, next_cursor = index.query(
+                filters=data.get('filters'),
+                sort=data.get('sort', 'case_id'),
+                min_points=int_or_none(data.get('min_points')),
+                max_points=int_or_none(data.get('max_points')),
+                cursor=cursor,
+                limit=page_size,
+            )
+        else:
+            cases, next_cursor = index.query(cursor=cursor, limit=page_size)
+
+        response = {
+            'action': 'page',
+            'version': index.version,
+            'cases': [case_to_dict(c) for c in cases],
+            'cursor': next_cursor,
+            'selected_cases': player.selected_cases_list
+        }
+        if not cursor:
+            response['facets'] = index.facets()
+            response['claims'] = claims.claims
+        return {player.id_in_group: response}
+
+    elif action == 'suggest':
+        # Best selection of the free cases for the judge's remaining budget
+        objective = data.get('objective')
+        if objective not in OBJECTIVES:
+            objective = 'points'
+        # negative if a re-upload raised the points of selected cases
+        remaining = max(player.budget - player.committed_points, 0)
+        key = (player.subsession.id, index.version, claims.version, remaining, objective)
+        case_ids, total, exact = suggestions.get(key, lambda: suggest(
+            [
+                (c.case_id, c.points)
+                for c in index.unassigned()
+                if claims.holder(c.case_id) is None
+            ],
+            remaining,
+            objective,
+        ))
+        return {
+            player.id_in_group: {
+                'action': 'suggest',
+                'objective': objective,
+                'case_ids': case_ids,
+                'total_points': total,
+                'exact': exact
+            }
+        }
+
+    elif action == 'describe':
+        # Descriptions for the cards currently on the judge's screen;
+        # ids that aren't integers are skipped
+        case_ids = data.get('case_ids')
+        if not isinstance(case_ids, list):
+            case_ids = []
+        case_ids = [cid for cid in map(int_or_none, case_ids) if cid is not None]
+        return {
+            player.id_in_group: {
+                'action': 'describe',
+                'descriptions': descriptions.describe(player.subsession, case_ids)
             }
         }
 
     elif action == 'select_case':
-        case_id = int(data.get('case_id'))
-        case_list = Case.filter(subsession=player.subsession, case_id=case_id)
-        if not case_list:
+        case_id = int_or_none(data.get('case_id'))
+        if case_id not in index:
             return {player.id_in_group: {'action': 'case_not_found', 'case_id': case_id}}
 
-        case = case_list[0]
-        j_list = Judge.filter(subsession=player.subsession, player=player)
-        judge = j_list[0] if j_list else None
-        
-        if not judge:
+        if not cached_judge(player):
             return {player.id_in_group: {'action': 'case_unavailable', 'case_id': case_id}}
 
-        # 1) Sum up existing selected cases
-        selected_cases = player.selected_cases_list
-        total_points_already = 0
-        for cid in selected_cases:
-            c_list2 = Case.filter(subsession=player.subsession, case_id=cid)
-            if c_list2:
-                total_points_already += c_list2[0].points
-
-        # 2) Check if adding this new case's .points exceeds player's budget
-        new_total = total_points_already + case.points
-        if new_total > player.budget:
-            # EXCEEDS BUDGET
-            return {
-                player.id_in_group: {
-                    'action': 'exceed_budget',
-                    'case_id': case_id,
-                    'excess_amount': new_total - player.budget
-                }
-            }
-        
-        # If it does not exceed budget, we can add it
-        if case_id not in selected_cases:
-            selected_cases.append(case_id)
-            player.selected_cases_list = selected_cases
-
+        selected, rejected = select_cases(player, [case_id], index, claims, batcher)
+        if rejected:
+            rejection = dict(rejected[0])
+            rejection['action'] = REJECTION_ACTIONS[rejection.pop('reason')]
+            return {player.id_in_group: rejection}
         return {player.id_in_group: {'action': 'case_assigned', 'case_id': case_id}}
 
     elif action == 'unselect_case':
-        case_id = int(data.get('case_id'))
-        selected_cases = player.selected_cases_list
-        if case_id in selected_cases:
-            selected_cases.remove(case_id)
-            player.selected_cases_list = selected_cases
+        case_id = int_or_none(data.get('case_id'))
+        if case_id is not None:
+            unselect_cases(player, [case_id], index, claims, batcher)
         return {player.id_in_group: {'action': 'case_unselected', 'case_id': case_id}}
 
+    elif action in ('select_many', 'unselect_many'):
+        # Sets many cases in one message (e.g. from admin tools or bots).
+        # validate_selection reports ids that aren't integers as 'invalid'.
+        case_ids = data.get('case_ids')
+        if not isinstance(case_ids, list):
+            case_ids = []
+        if action == 'select_many':
+            if not cached_judge(player):
+                selected = []
+                rejected = [
+                    {'case_id': cid, 'reason': 'unavailable'} for cid in case_ids
+                ]
+            else:
+                selected, rejected = select_cases(
+                    player, case_ids, index, claims, batcher,
+                    all_or_nothing=bool(data.get('all_or_nothing')),
+                )
+            unselected = []
+        else:
+            selected = rejected = []
+            case_ids = [cid for cid in map(int_or_none, case_ids) if cid is not None]
+            unselected = unselect_cases(player, case_ids, index, claims, batcher)
+
+        return {
+            player.id_in_group: {
+                'action': 'selection',
+                'selected': selected,
+                'unselected': unselected,
+                'rejected': rejected,
+                'selected_cases': player.selected_cases_list,
+                'committed_points': player.committed_points
+            }
+        }
+
+
+@instrument_live
+def admin_live_method(player, data):
+    """Receives the cases CSV in chunks (see common.upload)"""
+    return handle_upload(player, data)
+
 
 class Login(Page):
     """
@@ -194,6 +624,7 @@ class Login(Page):
             return "Please enter both username and password."
 
     @staticmethod
+    @timed
     def before_next_page(player: Player, timeout_happened):
         username = player.username
         password = player.password
@@ -203,11 +634,7 @@ class Login(Page):
         elif username.startswith("judge") and password == "judge":
             player.participant.vars['role'] = "judge"
             # Create the Judge record right away
-            Judge.create(
-                subsession=player.subsession,
-                player=player,
-                judge_id=player.id_in_group
-            )
+            register_judge(player, Judge)
         else:
             return ValueError
 
@@ -219,30 +646,33 @@ class Admin(Page):
     Judges to select/bid for. 
     """
     form_model = 'player'
-    form_fields = ['csv_data']
+    form_fields = ['csv_sha256']
+    live_method = admin_live_method
 
     @staticmethod
-    def before_next_page(player: Player, timeout_happened):
-        data_str = player.csv_data or ""
-        if not data_str.strip():
+    def error_message(player: Player, values):
+        digest = values['csv_sha256']
+        if not digest:
             return
-        f = io.StringIO(data_str)
-        reader = csv.DictReader(f, delimiter=',') 
-        num_cases = 0
-        for row in reader:
-            num_cases += 1
-            Case.create(
-                subsession=player.subsession,
-                case_id=int(row['Case_ID']),
-                case_type=row.get('Case_Type', ''),
-                region=row.get('Region', ''),
-                priority=row.get('Priority', ''),
-                points=int(row.get('Points', 0)),
-                date_filled=row.get('Date_Filled', ''),
-                description=row.get('Description', ''),
-            )
+        upload = get_upload(player)
+        if upload is None or not upload.is_valid(digest):
+            return "The file didn't finish uploading or has problems; please choose it again."
 
-        player.subsession.session.vars['num_cases'] = num_cases
+    @staticmethod
+    @timed
+    def before_next_page(player: Player, timeout_happened):
+        upload = get_upload(player)
+        if not player.csv_sha256 or upload is None:
+            discard_upload(player)
+            return  # No data uploaded
+
+        with upload.open() as f:
+            result, upserted, retired = ingest_cases(Case, player.subsession, f)
+        discard_upload(player)
+        player.csv_rows = result['rows']
+        player.subsession.session.vars['ingest'] = result
+        player.subsession.session.vars['num_cases'] = result['rows']
+        apply_case_changes(player.subsession, upserted, retired)
 
     @staticmethod
     def is_displayed(player: Player):
@@ -259,10 +689,12 @@ class AdminReview(Page):
         return player.participant.vars.get('role') == 'admin'
 
     @staticmethod
+    @timed
     def vars_for_template(player: Player):
         return {
-            'cases': Case.filter(subsession=player.subsession),
-            'num_cases': player.subsession.session.vars.get('num_cases', 0)
+            'cases': Case.filter(subsession=player.subsession, retired=False),
+            'num_cases': player.subsession.session.vars.get('num_cases', 0),
+            'ingest': player.subsession.session.vars.get('ingest'),
         }
 
 
@@ -272,54 +704,88 @@ class SelectCases(Page):
     """
     live_method = live_method
     form_model = 'player'
-    form_fields = ['selected_case_ids']
+    form_fields = ['submitted_case_ids']
 
     @staticmethod
     def is_displayed(player: Player):
         return player.participant.vars.get('role') == 'judge'
 
     @staticmethod
-    def vars_for_template(player: Player):
-        cases = list(Case.filter(subsession=player.subsession, is_assigned=False))
-        # you can mutate .points if you want to demonstrate something
-        for c in cases:
-            c.points += 1
+    def js_vars(player: Player):
+        return {
+            'pool_key': f'greedy-pool-{player.session.code}-{player.round_number}',
+            'id_in_group': player.id_in_group,
+        }
 
+    @staticmethod
+    @timed
+    def vars_for_template(player: Player):
+        # the cases themselves are loaded over the live channel, page by page
         return {
-            'cases': [
-                {
-                    'case_id': c.case_id,
-                    'points': c.points
-                }
-                for c in cases
-            ],
             'round_number': player.subsession.round_number,
             'budget': player.budget
         }
 
     @staticmethod
+    @timed
     def before_next_page(player: Player, timeout_happened):
-        selected_case_ids = player.selected_cases_list
-        j_list = Judge.filter(subsession=player.subsession, player=player)
-        current_judge = j_list[0] if j_list else None
+        index = get_case_index(player.subsession)
+        current_judge = cached_judge(player)
+        submitted = parse_case_ids(player.field_maybe_none('submitted_case_ids'))
+        player.submitted_case_ids = ''
+
+        # checked against the live selection, before the submitted one
+        # replaces it
+        if not ledger_is_consistent(player, index):
+            # the live handlers keep the ledger in step; this shouldn't happen
+            logger.warning(
+                'Player %s: committed_points %s does not match the selection; reconciling',
+                player.id, player.committed_points,
+            )
 
         if not current_judge:
+            reconcile_ledger(player, index)
             return
 
-        # unassign old
-        old_cases = Case.filter(subsession=player.subsession, assigned_judge=current_judge)
-        for c in old_cases:
-            c.is_assigned = False
-            c.assigned_judge = None
-
-        # assign new
-        for cid in selected_case_ids:
-            c_list = Case.filter(subsession=player.subsession, case_id=cid)
-            if c_list:
-                c = c_list[0]
-                if not c.is_assigned:
-                    c.is_assigned = True
-                    c.assigned_judge = current_judge
+        judge_pk = current_judge['pk']
+        batcher = get_event_batcher(player.subsession)
+        batcher.disconnect(player.id_in_group)
+        claims = get_claim_table(player.subsession)
+
+        # The submitted list replaces the live selection, so check all of it
+        # again: keep, in order, the cases this judge may take (no one else
+        # has them) for as long as they fit the budget
+        old = index.assigned_ids(judge_pk)
+        new, total, rejected = validate_selection(
+            submitted,
+            index,
+            player.budget,
+            is_available=lambda cid: (
+                (cid in old or not index.is_assigned(cid))
+                and claims.holder(cid) in (None, player.id_in_group)
+            ),
+        )
+        player.selection = new
+        player.committed_points = total
+        player.participant.vars['rejected_cases'] = rejected
+
+        # write only what changed since the judge's last submit
+        to_release = old.difference(new)
+        to_assign = set(new).difference(old)
+        write_assignments(player.subsession, to_release, None)
+        write_assignments(player.subsession, to_assign, judge_pk)
+        index.release_many(to_release)
+        index.assign_many(to_assign, judge_pk)
+        for cid in to_assign:
+            batcher.remove(cid)
+
+        # the judge is done; whatever they still hold goes back to the pool
+        for cid in list(claims.held.get(player.id_in_group, ())):
+            claims.release(cid, player.id_in_group)
+            if not index.is_assigned(cid):
+                batcher.release(cid, player.id_in_group)
+
+        player.subsession.case_pool_version = index.version
 
 
 class Results(Page):
@@ -331,17 +797,18 @@ class Results(Page):
         return player.participant.vars.get('role') == 'judge'
 
     @staticmethod
+    @timed
     def vars_for_template(player: Player):
-        all_cases = Case.filter(subsession=player.subsession)
-        j_list = Judge.filter(subsession=player.subsession, player=player)
-        current_judge = j_list[0] if j_list else None
+        index = get_case_index(player.subsession)
+        all_cases = index.all()
+        current_judge = cached_judge(player)
 
         if not current_judge:
             return {
                 'selected_cases': [],
                 'round_number': player.subsession.round_number,
             }
-        selected_cases = Case.filter(subsession=player.subsession, assigned_judge=current_judge)
+        selected_cases = index.assigned_to(current_judge['pk'])
         spent_points = sum(c.points for c in selected_cases)
         leftover = player.budget - spent_points
 
@@ -349,7 +816,7 @@ class Results(Page):
             {
                 'case_id': c.case_id,
                 'points': c.points,
-                'judge_id': current_judge.judge_id
+                'judge_id': current_judge['judge_id']
             }
             for c in selected_cases
         ]
@@ -359,10 +826,15 @@ class Results(Page):
             'selected_cases': case_list,
             'round_number': player.subsession.round_number,
             'spent_points': spent_points,
-            'leftover': leftover
+            'leftover': leftover,
+            'rejected_cases': player.participant.vars.get('rejected_cases', []),
         }
 
 
+def vars_for_admin_report(subsession: Subsession):
+    return {'metrics': metrics_summary()}
+
+
 page_sequence = [
     Login,
     Admin,
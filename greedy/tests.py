@@ -0,0 +1,110 @@
+from otree.api import Bot, Submission, expect
+from . import *
+import hashlib
+
+
+CSV = open('demo.csv').read()
+
+
+class PlayerBot(Bot):
+    def play_round(self):
+        if self.player.id_in_group == 1:
+            yield Login, dict(username='admin', password='admin')
+            yield Admin, dict(csv_sha256=hashlib.sha256(CSV.encode()).hexdigest())
+            yield AdminReview
+        else:
+            yield Login, dict(username=f'judge{self.player.id_in_group}', password='judge')
+            # resubmit what call_live_method selected (the page submits
+            # from JavaScript, so there is no submit button to find)
+            yield Submission(
+                SelectCases,
+                # judge 4's is garbage, which counts as an empty list
+                dict(submitted_case_ids={2: '[7, 3]', 3: '[5, 8]', 4: 'abc'}[self.player.id_in_group]),
+                check_html=False,
+            )
+            expect(ledger_is_consistent(self.player, get_case_index(self.subsession)), True)
+            expect(self.player.selected_cases_list, {2: [3, 7], 3: [5, 8], 4: []}[self.player.id_in_group])
+            yield Results
+
+
+def call_live_method(method, page_class, group, **kwargs):
+    if page_class == Admin:
+        method(1, {'action': 'upload_start'})
+        method(1, {'action': 'upload_chunk', 'seq': 0, 'data': CSV})
+        method(1, {'action': 'upload_end'})
+        return
+
+    # only JSON lists are taken from the form; stored selections refuse
+    # to expand past MAX_SELECTION_IDS
+    for bad in ('abc', '1-999999999', '["a"]', '{"a": 1}'):
+        expect(validate_selection(parse_case_ids(bad), get_case_index(group.subsession), 2000, bool)[0], [])
+    for bad in ('1-999999999', '5-3', '[{}]'):
+        try:
+            CaseSelection.decode(bad)
+        except ValueError:
+            continue
+        raise AssertionError(f'{bad!r} was decoded')
+
+    # nothing fits a judge who is over budget (e.g. after a re-upload)
+    expect(suggest([(1, 5)], -5), ([], 0, True))
+
+    # ids that aren't integers are skipped or reported, never raised on
+    expect(list(method(2, {'action': 'describe', 'case_ids': ['x', None, 1]})[2]['descriptions']), [1])
+    expect(method(2, {'action': 'describe', 'case_ids': 'abc'})[2]['descriptions'], {})
+    expect(method(2, {'action': 'select_case', 'case_id': 'x'})[2]['action'], 'case_not_found')
+    expect(method(2, {'action': 'unselect_case', 'case_id': None})[2]['action'], 'case_unselected')
+
+    # a stale or tampered version gets a full snapshot
+    for version in ('x', [1], {'v': 1}, None):
+        expect(method(2, {'action': 'sync', 'version': version})[2]['action'], 'load')
+
+    # malformed queries are served as if the bad parts weren't there
+    first = method(2, {'action': 'query', 'sort': 'points'})[2]['cases']
+    for bad in (
+        {'cursor': ['a']}, {'cursor': 'abc'}, {'cursor': [1, 2, 3]}, {'cursor': {'a': 1}},
+        {'filters': 'x'}, {'filters': {'region': ['x']}}, {'sort': ['points']}, {'page_size': -5},
+    ):
+        response = method(2, dict({'action': 'query', 'sort': 'points'}, **bad))[2]
+        expect(len(response['cases']) > 0, True)
+    expect(method(2, {'action': 'query', 'sort': 'points', 'cursor': ['1', 1]})[2]['cases'], first)
+
+    # the budget is 2000 points: case 1 is 1025, 3 is 1000, 5 is 900,
+    # 7 is 805, 8 is 910
+    expect(method(2, {'action': 'select_case', 'case_id': 1})[2]['action'], 'case_assigned')
+    expect(method(2, {'action': 'select_case', 'case_id': 3})[2]['action'], 'exceed_budget')
+    method(2, {'action': 'select_case', 'case_id': 7})
+    method(2, {'action': 'unselect_case', 'case_id': 1})
+    method(2, {'action': 'select_case', 'case_id': 3})
+    response = method(3, {'action': 'select_many', 'case_ids': [5, 'x', None, 8, 1]})[3]
+    expect(response['selected'], [5, 8])
+    expect([r['reason'] for r in response['rejected']], ['invalid', 'invalid', 'exceeds_budget'])
+    expect(response['committed_points'], 1810)
+    expect(method(3, {'action': 'unselect_many', 'case_ids': ['x', [1], 99]})[3]['unselected'], [])
+    # judge 2 holds case 7
+    expect(method(4, {'action': 'select_case', 'case_id': 7})[4]['action'], 'case_unavailable')
+
+    # pings don't renew a lease, so a judge who only leaves the tab open
+    # loses their claims once it runs out
+    claims = get_claim_table(group.subsession)
+    method(4, {'action': 'select_case', 'case_id': 9})
+    expires = claims.expires[4]
+    method(4, {'action': 'ping'})
+    expect(claims.expires[4], expires)
+    claims.expires[4] = claims.last_sweep = 0
+    method(4, {'action': 'ping'})
+    expect(claims.holder(9), None)
+
+    # a re-upload that changes a case reaches judges already on the page
+    index = get_case_index(group.subsession)
+    version = index.version
+    Case.filter(subsession=group.subsession, case_id=10)[0].points = 700
+    apply_case_changes(group.subsession, [10], [])
+    get_event_batcher(group.subsession).last_flush = 0
+    events = method(3, {'action': 'ping'})[3]['events']
+    expect({'type': 'pool', 'version': index.version} in events, True)
+    synced = method(3, {'action': 'sync', 'version': version, 'paged': True})[3]
+    expect([(c['case_id'], c['points']) for c in synced['cases']], [(10, 700)])
+
+    for player in group.get_players():
+        expect(ledger_is_consistent(player, get_case_index(player.subsession)), True)
+    expect([p.committed_points for p in group.get_players()], [0, 1805, 1810, 0])
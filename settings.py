@@ -5,6 +5,7 @@ SESSION_CONFIGS = [
         name='greedy',
         app_sequence=['greedy'],
         num_demo_participants=4,
+        claim_lease_seconds=300,
     ),
     dict(
         name='batch',